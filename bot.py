@@ -5,13 +5,38 @@ import aiohttp
 from discord.ext import commands, tasks
 import json
 import os
-from datetime import datetime, timezone
+import re
+from datetime import datetime, timezone, date, timedelta
 import asyncio
 import io
-import pandas as pd
+import signal
+import gzip
+import shutil
+import csv
+import sqlite3
+import itertools
+import bisect
+import heapq
+import random
+import concurrent.futures
+import multiprocessing
+import time
+from collections import OrderedDict
+import mmap
+import struct
+from array import array
+import numpy as np
+try:
+    from PIL import Image
+except ImportError:  # perceptual avatar hashing is optional
+    Image = None
 
 # Load configuration from .conf file
-def load_config(config_file: str = '.conf') -> dict:
+CONFIG_FILE = '.conf'
+CONFIG_RELOAD_INTERVAL = 30  # Seconds between checks of .conf for outside edits
+
+
+def load_config(config_file: str = CONFIG_FILE) -> dict:
     """Load configuration from JSON file."""
     try:
         with open(config_file, 'r') as f:
@@ -21,23 +46,309 @@ def load_config(config_file: str = '.conf') -> dict:
     except json.JSONDecodeError:
         raise ValueError(f"Configuration file '{config_file}' contains invalid JSON.")
 
-CONFIG = load_config()
 
-# Extract configuration values
-PING_LOG_CHANNEL_ID = CONFIG['PING_LOG_CHANNEL_ID']
-LFG_CHANNEL_IDS = CONFIG['LFG_CHANNEL_IDS']
-ADMINISTRATOR_ROLES = CONFIG['ADMINISTRATOR_ROLES']
-LOG_CHANNEL_ID = CONFIG['LOG_CHANNEL_ID']
-ROLE_THRESHOLDS = CONFIG['ROLE_THRESHOLDS']
-ROLES_EXCEPTIONS = CONFIG.get('ROLES_EXCEPTIONS', [])  # Roles that should not be removed by rolepurge
-MD5_CHECK_STATUS = CONFIG['MD5_CHECK_STATUS']
-MD5_ACC_AGE_NOTIFICATION_LIMIT = CONFIG['MD5_ACC_AGE_NOTIFICATION_LIMIT']
+# Startup-only settings: key -> (default, type, min, max). The type is int, float (ints accepted), bool,
+# str or a tuple of allowed values; min/max bound numbers (None: unbounded).
+CONFIG_SETTINGS = {
+    'PING_FLUSH_INTERVAL': (30, float, 1, 3600),
+    'PING_FLUSH_MAX_CHANGES': (200, int, 1, None),
+    'PING_SNAPSHOT_EVERY': (5000, int, 1, None),
+    'STORAGE_BACKEND': ('json', ('json', 'sqlite'), None, None),
+    'SQLITE_DB_FILE': ('vanity_tracker.db', str, None, None),
+    'COMMAND_LOG_MAX_BYTES': (5 * 1024 * 1024, int, 1024, None),
+    'COMMAND_LOG_BACKUPS': (5, int, 1, 100),
+    'PING_BUCKET_DAYS': (92, int, 1, 3660),
+    'HTTP_POOL_SIZE': (20, int, 1, 1000),
+    'HTTP_CONNECT_TIMEOUT': (5, float, 0.1, 300),
+    'HTTP_READ_TIMEOUT': (10, float, 0.1, 300),
+    'HTTP_RETRIES': (3, int, 1, 10),
+    'AVATAR_MAX_BYTES': (8 * 1024 * 1024, int, 1024, None),
+    'AVATAR_HASH_SIZE': (1024, tuple(2 ** i for i in range(4, 13)), None, None),
+    'AVATAR_HASH_STATIC': (False, bool, None, None),
+    'BACKFILL_CONCURRENCY': (3, int, 1, 50),
+    'REPORT_FILE_THRESHOLD': (200, int, 0, None),
+    'EXPORT_COMPRESS_THRESHOLD': (1024 * 1024, int, 0, None),
+    'AVATAR_CACHE_SIZE': (50000, int, 1, None),
+    'AVATAR_CACHE_TTL': (7 * 24 * 3600, float, 0, None),
+    'AVATAR_CACHE_FILE': ('avatar_cache.json', str, None, None),
+    'JOIN_WORKERS': (4, int, 1, 100),
+    'JOIN_QUEUE_MAX': (2000, int, 1, None),
+    'JOIN_RAID_THRESHOLD': (50, int, 1, None),
+    'PHASH_CHECK': (False, bool, None, None),
+    'PHASH_ALGORITHM': ('dhash', ('dhash', 'phash'), None, None),
+    'PHASH_MAX_DISTANCE': (8, int, 0, 64),
+    'PHASH_FILE': ('phash_list.txt', str, None, None),
+    'PHASH_WORKERS': (2, int, 1, 64),
+    'NOTIFY_COALESCE_DELAY': (2, float, 0, 60),
+    'WARNING_MAX_AGE': (7 * 24 * 3600, float, 60, None),
+    'ROLEPURGE_INTERVAL': (0.5, float, 0, 60),
+    'MD5_SCAN_CONCURRENCY': (8, int, 1, 100),
+    'BLOCKLIST_RELOAD_INTERVAL': (30, float, 1, 86400),
+    'BLOCKLIST_FORMAT': ('text', ('text', 'binary'), None, None),
+    'BLOCKLIST_BIN_FILE': ('list.bin', str, None, None),
+    'BLOCKLIST_BLOOM': (True, bool, None, None),
+}
+
+
+def setting_error(key: str, value, spec: tuple) -> str | None:
+    """Why value is not acceptable for the startup setting key, or None if it is."""
+    _, kind, low, high = spec
+    if isinstance(kind, tuple):
+        return None if value in kind else f"{key} must be one of {', '.join(map(repr, kind))}"
+    if kind is bool or kind is str:
+        return None if isinstance(value, kind) else f"{key} must be {'true or false' if kind is bool else 'a string'}"
+    if isinstance(value, bool) or not isinstance(value, (int, float) if kind is float else int):
+        return f"{key} must be {'a number' if kind is float else 'a whole number'}"
+    if (low is not None and value < low) or (high is not None and value > high):
+        bounds = f"between {low} and {high}" if high is not None else f"at least {low}"
+        return f"{key} must be {bounds}"
+    return None
+
+
+def is_snowflake(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+
+class BotConfig:
+    """Immutable, validated view of .conf.
+
+    The settings read on hot paths are compiled once at load: ID lists become frozensets and
+    ROLE_THRESHOLDS gets a role -> category reverse index, so every membership test is O(1). A reload
+    builds a whole new BotConfig and rebinds CONFIG, so a reader holding CONFIG never sees a mix of old
+    and new values. The CONFIG_SETTINGS keys are checked against their type and bounds too, and read once
+    at startup through get().
+    """
+
+    __slots__ = ('raw', 'ping_log_channel_id', 'log_channel_id', 'lfg_channel_ids', 'lfg_channel_set',
+                 'admin_roles', 'role_exceptions', 'role_thresholds', 'role_category', 'md5_check_status',
+                 'md5_acc_age_limit', 'settings')
+
+    def __init__(self, raw: dict):
+        errors = []
+
+        def snowflake_list(key):
+            values = raw.get(key, [])
+            if not isinstance(values, list) or not all(is_snowflake(v) for v in values):
+                errors.append(f"{key} must be a list of Discord IDs")
+                return ()
+            return tuple(values)
+
+        if not is_snowflake(raw.get('PING_LOG_CHANNEL_ID')):
+            errors.append("PING_LOG_CHANNEL_ID must be a Discord channel ID")
+        if raw.get('LOG_CHANNEL_ID') is not None and not is_snowflake(raw['LOG_CHANNEL_ID']):
+            errors.append("LOG_CHANNEL_ID must be a Discord channel ID or null")
+        if not isinstance(raw.get('MD5_CHECK_STATUS'), bool):
+            errors.append("MD5_CHECK_STATUS must be true or false")
+        age_limit = raw.get('MD5_ACC_AGE_NOTIFICATION_LIMIT')
+        if not isinstance(age_limit, int) or isinstance(age_limit, bool) or age_limit < 0:
+            errors.append("MD5_ACC_AGE_NOTIFICATION_LIMIT must be a non-negative number of days")
+        for key in ('LFG_CHANNEL_IDS', 'ADMINISTRATOR_ROLES'):
+            if key not in raw:
+                errors.append(f"{key} is missing")
+        lfg_channel_ids = snowflake_list('LFG_CHANNEL_IDS')
+        admin_roles = snowflake_list('ADMINISTRATOR_ROLES')
+        role_exceptions = snowflake_list('ROLES_EXCEPTIONS')
+
+        role_thresholds, role_category = {}, {}
+        thresholds = raw.get('ROLE_THRESHOLDS')
+        if not isinstance(thresholds, dict) or not thresholds:
+            errors.append("ROLE_THRESHOLDS must map at least one category to its role_id list and threshold")
+            thresholds = {}
+        for category, data in thresholds.items():
+            role_ids = data.get('role_id') if isinstance(data, dict) else None
+            threshold = data.get('threshold') if isinstance(data, dict) else None
+            if not isinstance(role_ids, list) or not all(is_snowflake(r) for r in role_ids):
+                errors.append(f"ROLE_THRESHOLDS.{category}.role_id must be a list of Discord role IDs")
+                continue
+            if not isinstance(threshold, int) or isinstance(threshold, bool) or threshold < 1:
+                errors.append(f"ROLE_THRESHOLDS.{category}.threshold must be a positive number")
+                continue
+            role_thresholds[category] = {'role_id': frozenset(role_ids), 'threshold': threshold}
+            for role_id in role_ids:
+                role_category.setdefault(role_id, category)  # first category wins
+
+        settings = {}
+        for key, spec in CONFIG_SETTINGS.items():
+            settings[key] = raw.get(key, spec[0])
+            problem = setting_error(key, settings[key], spec)
+            if problem:
+                errors.append(problem)
+
+        if errors:
+            raise ValueError("Invalid configuration: " + "; ".join(errors))
+
+        set_ = object.__setattr__
+        set_(self, 'raw', raw)
+        set_(self, 'ping_log_channel_id', raw['PING_LOG_CHANNEL_ID'])
+        set_(self, 'log_channel_id', raw.get('LOG_CHANNEL_ID'))
+        set_(self, 'lfg_channel_ids', lfg_channel_ids)  # config order, for backfill
+        set_(self, 'lfg_channel_set', frozenset(lfg_channel_ids))
+        set_(self, 'admin_roles', frozenset(admin_roles))
+        set_(self, 'role_exceptions', frozenset(role_exceptions))
+        set_(self, 'role_thresholds', role_thresholds)
+        set_(self, 'role_category', role_category)
+        set_(self, 'md5_check_status', raw['MD5_CHECK_STATUS'])
+        set_(self, 'md5_acc_age_limit', age_limit)
+        set_(self, 'settings', settings)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("BotConfig is immutable; change settings through save_config()")
+
+    def get(self, key: str, default=None):
+        """Validated value of a CONFIG_SETTINGS key (its default when unset), or the raw value of any other key."""
+        if key in self.settings:
+            return self.settings[key]
+        return self.raw.get(key, default)
+
+    def replace(self, **changes) -> 'BotConfig':
+        """A new, validated BotConfig with the given raw .conf keys changed."""
+        return BotConfig({**self.raw, **changes})
+
+
+CONFIG = BotConfig(load_config())
+config_lock = asyncio.Lock()
+
+
+def config_file_stat():
+    try:
+        st = os.stat(CONFIG_FILE)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+config_stat = config_file_stat()
+
+
+def apply_config(new_config: BotConfig):
+    """Swap in new_config, unless it changes something only a restart can pick up."""
+    global CONFIG
+    if list(new_config.role_thresholds) != list(CONFIG.role_thresholds):
+        # Ping counters, leaderboards and the /leaderboard choices are laid out per category at startup
+        raise ValueError("ROLE_THRESHOLDS categories changed; restart the bot to apply that")
+    restart_keys = sorted(k for k in new_config.raw.keys() | CONFIG.raw.keys()
+                          if k not in RELOADABLE_CONFIG_KEYS and new_config.raw.get(k) != CONFIG.raw.get(k))
+    CONFIG = new_config
+    if restart_keys:
+        print(f"[CONFIG] {', '.join(restart_keys)} changed; those take effect after a restart")
+
+
+async def save_config(**changes) -> BotConfig:
+    """Validate, persist (temp file + rename) and apply changes to .conf."""
+    global config_stat
+    async with config_lock:
+        new_config = CONFIG.replace(**changes)
+        write_text_atomic(CONFIG_FILE, json.dumps(new_config.raw, indent=4))
+        config_stat = config_file_stat()
+        apply_config(new_config)
+    return new_config
+
+
+async def reload_config(force: bool = False) -> bool:
+    """Reread .conf if it changed on disk (or unconditionally with force). Invalid files are rejected
+    and the running config is kept. Returns True if a new config was applied."""
+    global config_stat
+    async with config_lock:
+        stat = config_file_stat()
+        if not force and stat == config_stat:
+            return False
+        config_stat = stat
+        apply_config(BotConfig(load_config()))
+    return True
+
+
+def is_admin(member) -> bool:
+    """Whether member holds one of the ADMINISTRATOR_ROLES."""
+    admin_roles = CONFIG.admin_roles
+    return any(role.id in admin_roles for role in getattr(member, 'roles', ()))
+
+
+# Extract configuration values. The ones in RELOADABLE_CONFIG_KEYS are read live from CONFIG (see
+# BotConfig); the rest are fixed for the lifetime of the process.
+RELOADABLE_CONFIG_KEYS = frozenset({
+    'PING_LOG_CHANNEL_ID', 'LFG_CHANNEL_IDS', 'ADMINISTRATOR_ROLES', 'LOG_CHANNEL_ID', 'ROLE_THRESHOLDS',
+    'ROLES_EXCEPTIONS', 'MD5_CHECK_STATUS', 'MD5_ACC_AGE_NOTIFICATION_LIMIT',
+})
+PING_FLUSH_INTERVAL = CONFIG.get('PING_FLUSH_INTERVAL')  # Seconds between write-behind flushes of ping_data
+PING_FLUSH_MAX_CHANGES = CONFIG.get('PING_FLUSH_MAX_CHANGES')  # Flush early once this many changes are pending
+PING_SNAPSHOT_EVERY = CONFIG.get('PING_SNAPSHOT_EVERY')  # Fold the journal into a new snapshot after this many events
+STORAGE_BACKEND = CONFIG.get('STORAGE_BACKEND')  # 'json' (flat files) or 'sqlite'
+SQLITE_DB_FILE = CONFIG.get('SQLITE_DB_FILE')
+COMMAND_LOG_MAX_BYTES = CONFIG.get('COMMAND_LOG_MAX_BYTES')  # Rotate commands_log.jsonl at this size
+COMMAND_LOG_BACKUPS = CONFIG.get('COMMAND_LOG_BACKUPS')  # Rotated command log files to keep
+PING_BUCKET_DAYS = CONFIG.get('PING_BUCKET_DAYS')  # Keep daily ping buckets this long before rolling them into months
+HTTP_POOL_SIZE = CONFIG.get('HTTP_POOL_SIZE')  # Max concurrent connections for avatar downloads
+HTTP_CONNECT_TIMEOUT = CONFIG.get('HTTP_CONNECT_TIMEOUT')  # Seconds
+HTTP_READ_TIMEOUT = CONFIG.get('HTTP_READ_TIMEOUT')  # Seconds
+HTTP_RETRIES = CONFIG.get('HTTP_RETRIES')  # Attempts per avatar download on transient failures
+AVATAR_MAX_BYTES = CONFIG.get('AVATAR_MAX_BYTES')  # Avatar downloads larger than this are aborted
+AVATAR_HASH_SIZE = CONFIG.get('AVATAR_HASH_SIZE')  # Pixel size requested from the CDN for hashing (power of 2)
+AVATAR_HASH_STATIC = CONFIG.get('AVATAR_HASH_STATIC')  # Hash the first frame (PNG) of animated avatars instead of the GIF
+AVATAR_CHUNK_SIZE = 64 * 1024  # Bytes hashed per read while streaming an avatar
+BACKFILL_CONCURRENCY = CONFIG.get('BACKFILL_CONCURRENCY')  # LFG channels fetched in parallel during a backfill
+REPORT_PAGE_SIZE = 10  # Users per report page
+REPORT_FILE_THRESHOLD = CONFIG.get('REPORT_FILE_THRESHOLD')  # Reports with more users also go out as a file
+EXPORT_DIR = 'exports'
+EXPORT_CHUNK_ROWS = 5000  # Rows per chunk when streaming an export
+EXPORT_COMPRESS_THRESHOLD = CONFIG.get('EXPORT_COMPRESS_THRESHOLD')  # gzip CSV/JSONL exports larger than this (bytes)
+AVATAR_CACHE_SIZE = CONFIG.get('AVATAR_CACHE_SIZE')  # Avatar MD5s kept in memory (LRU)
+AVATAR_CACHE_TTL = CONFIG.get('AVATAR_CACHE_TTL')  # Seconds before a cached avatar MD5 is refetched
+AVATAR_CACHE_FILE = CONFIG.get('AVATAR_CACHE_FILE')  # Persisted between restarts; "" to keep it in memory only
+JOIN_WORKERS = CONFIG.get('JOIN_WORKERS')  # Concurrent avatar checks for new members
+JOIN_QUEUE_MAX = CONFIG.get('JOIN_QUEUE_MAX')  # Joins waiting for a check beyond this are dropped
+JOIN_RAID_THRESHOLD = CONFIG.get('JOIN_RAID_THRESHOLD')  # Queue depth that switches the join check into raid mode
+PHASH_CHECK = CONFIG.get('PHASH_CHECK')  # Also match joins by perceptual hash (needs Pillow)
+PHASH_ALGORITHM = CONFIG.get('PHASH_ALGORITHM')  # 'dhash' or 'phash'
+PHASH_MAX_DISTANCE = CONFIG.get('PHASH_MAX_DISTANCE')  # Max Hamming distance (of 64 bits) that counts as a match
+PHASH_FILE = CONFIG.get('PHASH_FILE')
+PHASH_WORKERS = CONFIG.get('PHASH_WORKERS')  # Processes decoding and hashing avatars
+BAN_AUDIT_BUFFER = 100  # Recent ban audit-log entries kept (and fetched at once)
+BAN_AUDIT_DEBOUNCE = 1.0  # Seconds to wait so one audit-log fetch serves a burst of bans
+NOTIFY_COALESCE_DELAY = CONFIG.get('NOTIFY_COALESCE_DELAY')  # Seconds milestone messages wait to be merged into one
+WARNING_MAX_AGE = CONFIG.get('WARNING_MAX_AGE')  # Seconds before an open warning nobody acted on is dropped
+ROLEPURGE_INTERVAL = CONFIG.get('ROLEPURGE_INTERVAL')  # Seconds between member edits during a mass rolepurge
+MD5_SCAN_CONCURRENCY = CONFIG.get('MD5_SCAN_CONCURRENCY')  # Avatars hashed in parallel by /md5 scan
+BLOCKLIST_RELOAD_INTERVAL = CONFIG.get('BLOCKLIST_RELOAD_INTERVAL')  # Seconds between checks of list.txt for outside edits
+BLOCKLIST_FORMAT = CONFIG.get('BLOCKLIST_FORMAT')  # 'text' (list.txt in memory) or 'binary' (compiled, memory-mapped)
+BLOCKLIST_BIN_FILE = CONFIG.get('BLOCKLIST_BIN_FILE')
+BLOCKLIST_BLOOM = CONFIG.get('BLOCKLIST_BLOOM')  # Bloom filter in front of binary-format lookups
 
 # Bot configuration
+class VanityTrackerBot(commands.Bot):
+    """Bot with process-wide resources opened in setup_hook and released on close."""
+
+    async def setup_hook(self):
+        global md5_response_buttons
+        open_http_session()
+        # One persistent view handles the buttons of every warning message, old or new. Warnings are sent
+        # with a stopped copy so discord.py doesn't also keep a view per message.
+        self.add_view(MD5ResponseView())
+        md5_response_buttons = MD5ResponseView()
+        md5_response_buttons.stop()
+        join_pipeline.start()
+        start_background_tasks()
+        try:
+            await sync_command_tree()
+        except Exception as e:
+            print(f"Failed to sync commands: {e}")
+
+    async def close(self):
+        await super().close()
+        if seed_avatar_task is not None:
+            seed_avatar_task.cancel()
+        await close_http_session()
+        await asyncio.to_thread(avatar_hash_cache.save, AVATAR_CACHE_FILE)
+        if phash_executor is not None:
+            phash_executor.shutdown(wait=False, cancel_futures=True)
+
+
+md5_response_buttons = None  # Button layout for new warning messages, created in setup_hook
+
+
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
-bot = commands.Bot(command_prefix='!', intents=intents)
+bot = VanityTrackerBot(command_prefix='!', intents=intents)
 
 # Command logging
 async def log_command(interaction: discord.Interaction, command_name: str):
@@ -48,120 +359,1612 @@ async def log_command(interaction: discord.Interaction, command_name: str):
         "command": command_name,
         "timestamp": timestamp
     }
-    
-    try:
-        with open('commands_log.json', 'r') as f:
-            log_data = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        log_data = []
-    
-    log_data.append(log_entry)
-    
-    with open('commands_log.json', 'w') as f:
-        json.dump(log_data, f, indent=4)
+    await storage.log_command(log_entry)
+
+
+def write_text_atomic(file_path: str, payload: str):
+    """Write already-serialized text to file_path via a temp file + rename so readers never see a partial file."""
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
 
 
 # Data storage
-ping_data = {}
+# A ping event is (timestamp, user_id, category, role_id, channel_id, message_id).
+# ping_data (an in-memory PingStats) is authoritative for the hot path; a storage backend persists the
+# events in batches and serves the command, moderation and stats queries.
+PING_DATA_FILE = 'ping_data.json'
+PING_JOURNAL_DIR = 'ping_journal'
+COMMANDS_LOG_FILE = 'commands_log.jsonl'
+LEGACY_COMMANDS_LOG_FILE = 'commands_log.json'
+BAN_LOG_FILE = 'bot_ban_log.txt'
 
-# Load existing data
-try:
-    with open('ping_data.json', 'r') as f:
-        ping_data = json.load(f)
-except FileNotFoundError:
-    pass
 
-# Track recent warning messages to edit if user is banned within 5 seconds
-recent_warnings = {}  # {user_id: {"message": discord.Message, "timestamp": datetime}}
+def journal_segment_path(segment: int, compressed: bool = False) -> str:
+    """Path of a journal segment (plain .jsonl while live, .jsonl.gz once compacted)."""
+    return os.path.join(PING_JOURNAL_DIR, f"{segment:06d}.jsonl" + (".gz" if compressed else ""))
+
+
+def list_journal_segments(compressed: bool = False) -> list[int]:
+    """Return the sorted segment numbers present in PING_JOURNAL_DIR."""
+    if not os.path.isdir(PING_JOURNAL_DIR):
+        return []
+    suffix = '.jsonl.gz' if compressed else '.jsonl'
+    segments = []
+    for name in os.listdir(PING_JOURNAL_DIR):
+        stem = name[:-len(suffix)]
+        if name.endswith(suffix) and stem.isdigit():
+            segments.append(int(stem))
+    return sorted(segments)
+
+
+def read_journal_segment(segment: int, compressed: bool = False):
+    """Yield decoded events from a segment, skipping a torn trailing line from a crash mid-append."""
+    opener = gzip.open if compressed else open
+    with opener(journal_segment_path(segment, compressed), 'rt', encoding='utf-8') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def iter_journal_events():
+    """Yield every journaled event, compacted segments first. A segment left both plain and gzipped by a
+    crash mid-compaction is read once."""
+    compressed = list_journal_segments(compressed=True)
+    for segment in compressed:
+        yield from read_journal_segment(segment, compressed=True)
+    compressed = set(compressed)
+    for segment in list_journal_segments():
+        if segment not in compressed:
+            yield from read_journal_segment(segment)
+
+
+def append_journal_events(segment: int, events: list[tuple]):
+    """Append events to a journal segment as compact JSON lines and fsync it."""
+    os.makedirs(PING_JOURNAL_DIR, exist_ok=True)
+    with open(journal_segment_path(segment), 'a', encoding='utf-8') as f:
+        f.writelines(json.dumps(event, separators=(',', ':')) + '\n' for event in events)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def compact_journal(before_segment: int):
+    """Gzip every plain segment already folded into the snapshot (raw history is kept, just compressed)."""
+    for segment in list_journal_segments():
+        if segment >= before_segment:
+            break
+        src = journal_segment_path(segment)
+        dst = journal_segment_path(segment, compressed=True)
+        with open(src, 'rb') as fin, gzip.open(f"{dst}.tmp", 'wb') as fout:
+            shutil.copyfileobj(fin, fout)
+        os.replace(f"{dst}.tmp", dst)
+        os.remove(src)
+
+
+def day_key(day: date) -> int:
+    """Bucket key for a UTC day, as YYYYMMDD (month keys are YYYYMM, i.e. day_key // 100)."""
+    return day.year * 10000 + day.month * 100 + day.day
+
+
+def key_day(key: int) -> date:
+    """Inverse of day_key."""
+    return date(key // 10000, key // 100 % 100, key % 100)
+
+
+class PingBuckets:
+    """Per-user ping counts bucketed by UTC day, rolled up into whole months once older than PING_BUCKET_DAYS.
+
+    Each bucket maps user_id to an array with one counter slot per ROLE_THRESHOLDS category.
+    """
+
+    def __init__(self, categories):
+        self.categories = list(categories)
+        self.slots = {category: i for i, category in enumerate(self.categories)}
+        self.days = {}  # {YYYYMMDD: {user_id: array}}
+        self.months = {}  # {YYYYMM: {user_id: array}}
+        self.since = None  # Day key of the first day the buckets cover; pings before it were never bucketed
+
+    def _row(self, buckets: dict, key: int, user_id: str) -> array:
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = {}
+        row = bucket.get(user_id)
+        if row is None:
+            row = bucket[user_id] = array('I', [0]) * len(self.categories)
+        return row
+
+    def add(self, user_id: str, category: str, timestamp: int, count: int = 1):
+        """Count pings for user_id in category on the UTC day of timestamp."""
+        slot = self.slots.get(category)
+        if slot is None:
+            return
+        day = datetime.fromtimestamp(timestamp, timezone.utc).date()
+        self._row(self.days, day_key(day), user_id)[slot] += count
+
+    def rollup(self, cutoff: int) -> bool:
+        """Fold day buckets older than cutoff (YYYYMMDD) into their month bucket. Returns True if anything moved."""
+        expired = [key for key in self.days if key < cutoff]
+        for key in expired:
+            month = self.months.setdefault(key // 100, {})
+            for user_id, row in self.days.pop(key).items():
+                target = month.get(user_id)
+                if target is None:
+                    month[user_id] = row
+                else:
+                    for i, count in enumerate(row):
+                        target[i] += count
+        return bool(expired)
+
+    def totals(self, start: date, end: date) -> dict[str, array]:
+        """Sum buckets between start and end (inclusive). Months that were rolled up are counted whole."""
+        start_key, end_key = day_key(start), day_key(end)
+        result = {}
+
+        def merge(bucket):
+            for user_id, row in bucket.items():
+                target = result.get(user_id)
+                if target is None:
+                    result[user_id] = array('I', row)
+                else:
+                    for i, count in enumerate(row):
+                        target[i] += count
+
+        for key, bucket in self.days.items():
+            if start_key <= key <= end_key:
+                merge(bucket)
+        for key, bucket in self.months.items():
+            if start_key // 100 <= key <= end_key // 100:
+                merge(bucket)
+        return result
+
+    def covered(self, start: date, end: date, cutoff: int) -> tuple[date, date]:
+        """The days totals(start, end) really counts. A rolled-up month (holding days before cutoff) is counted
+        whole, so a range starting or ending inside one is widened to its edges."""
+        if day_key(start) < cutoff and day_key(start) // 100 in self.months:
+            start = start.replace(day=1)
+        if day_key(end) < cutoff and day_key(end) // 100 in self.months:
+            month_end = (end.replace(day=1) + timedelta(days=31)).replace(day=1) - timedelta(days=1)
+            end = min(month_end, key_day(cutoff) - timedelta(days=1))
+        return start, end
+
+    def ensure_since(self):
+        """Set since for buckets loaded without it: the first day with a counter, or today if there is none.
+
+        A rolled-up month only proves coverage from its last day, so that is what an oldest month counts as.
+        """
+        if self.since is not None:
+            return
+        if self.months:
+            month = min(self.months)
+            first = date(month // 100, month % 100, 1)
+            self.since = day_key((first + timedelta(days=31)).replace(day=1) - timedelta(days=1))
+        elif self.days:
+            self.since = min(self.days)
+        else:
+            self.since = day_key(datetime.now(timezone.utc).date())
+
+    def since_day(self) -> date:
+        self.ensure_since()
+        return key_day(self.since)
+
+    def category_totals(self) -> dict[str, int]:
+        """Pings per category summed over every day and month bucket."""
+        sums = np.zeros(len(self.categories), dtype=np.int64)
+        for buckets in (self.days, self.months):
+            for bucket in buckets.values():
+                if bucket:
+                    rows = np.frombuffer(b''.join(row.tobytes() for row in bucket.values()), dtype=np.uint32)
+                    sums += rows.reshape(-1, len(self.categories)).sum(axis=0, dtype=np.int64)
+        return dict(zip(self.categories, sums.tolist()))
+
+    def _as_stats(self, row: array) -> dict:
+        return {'total_pings': sum(row), 'categories': dict(zip(self.categories, row))}
+
+    def stats(self, start: date, end: date) -> dict[str, dict]:
+        """ping_data-shaped stats for every user with pings between start and end."""
+        return {user_id: self._as_stats(row) for user_id, row in self.totals(start, end).items()}
+
+    def user_stats(self, user_id: str, start: date, end: date) -> dict | None:
+        """ping_data-shaped stats for one user between start and end, or None if they have no pings."""
+        start_key, end_key = day_key(start), day_key(end)
+        row = array('I', [0]) * len(self.categories)
+        found = False
+        for buckets, lo, hi in ((self.days, start_key, end_key), (self.months, start_key // 100, end_key // 100)):
+            for key, bucket in buckets.items():
+                if lo <= key <= hi and user_id in bucket:
+                    found = True
+                    for i, count in enumerate(bucket[user_id]):
+                        row[i] += count
+        return self._as_stats(row) if found else None
+
+    def load_row(self, period: str, key: int, user_id: str, category: str, count: int):
+        """Load one stored counter (period is 'day' or 'month')."""
+        slot = self.slots.get(category)
+        if slot is not None:
+            self._row(self.days if period == 'day' else self.months, key, user_id)[slot] += count
+
+    def rows(self):
+        """Yield (period, key, user_id, category, count) for every non-zero counter."""
+        for period, buckets in (('day', self.days), ('month', self.months)):
+            for key, bucket in buckets.items():
+                for user_id, row in bucket.items():
+                    for category, count in zip(self.categories, row):
+                        if count:
+                            yield period, key, user_id, category, count
+
+    def to_dict(self) -> dict:
+        return packed_buckets_to_dict(self.pack())
+
+    def pack(self) -> dict:
+        """Frozen copy for serializing off the event loop: each bucket's rows packed into one bytes object."""
+        def pack_period(buckets):
+            return [(key, list(bucket), b''.join(row.tobytes() for row in bucket.values())) for key, bucket in buckets.items()]
+        return {'categories': list(self.categories), 'since': self.since,
+                'days': pack_period(self.days), 'months': pack_period(self.months)}
+
+    def load_dict(self, saved: dict):
+        """Load buckets saved by to_dict, remapping columns if the category list changed."""
+        saved_categories = saved.get('categories', [])
+        self.since = saved.get('since')
+        for period in ('day', 'month'):
+            for key, bucket in saved.get(f'{period}s', {}).items():
+                for user_id, counts in bucket.items():
+                    for category, count in zip(saved_categories, counts):
+                        if count:
+                            self.load_row(period, int(key), user_id, category, count)
+
+
+def packed_buckets_to_dict(packed: dict) -> dict:
+    """The to_dict layout of a PingBuckets.pack() result."""
+    width = len(packed['categories'])
+
+    def unpack_period(buckets):
+        return {str(key): dict(zip(user_ids, np.frombuffer(rows, dtype=np.uint32).reshape(-1, width).tolist()))
+                for key, user_ids, rows in buckets}
+    return {'categories': packed['categories'], 'since': packed['since'],
+            'days': unpack_period(packed['days']), 'months': unpack_period(packed['months'])}
+
+
+def write_ping_snapshot(journal_segment: int, stats: 'PingStats', packed_buckets: dict):
+    """Serialize and atomically write ping_data.json from frozen copies (runs in a worker thread)."""
+    payload = json.dumps({'journal_segment': journal_segment, 'stats': stats.to_columns(),
+                          'buckets': packed_buckets_to_dict(packed_buckets)})
+    write_text_atomic(PING_DATA_FILE, payload)
+
+
+def bucket_cutoff() -> int:
+    """Day key before which day buckets are rolled up into months."""
+    return day_key(datetime.now(timezone.utc).date() - timedelta(days=PING_BUCKET_DAYS))
+
+
+def parse_period(value: str | None) -> tuple[date, date, str] | None:
+    """Parse a report period into (start, end, label), or None for lifetime totals.
+
+    Accepts 'all', '<N>d' (last N days), 'month' (this month), 'last_month',
+    'YYYY-MM-DD' or 'YYYY-MM-DD..YYYY-MM-DD'. Raises ValueError otherwise.
+    """
+    value = (value or 'all').strip().lower()
+    today = datetime.now(timezone.utc).date()
+    if value == 'all':
+        return None
+    if value == 'month':
+        return today.replace(day=1), today, today.strftime('%B %Y')
+    if value == 'last_month':
+        end = today.replace(day=1) - timedelta(days=1)
+        return end.replace(day=1), end, end.strftime('%B %Y')
+    if value.endswith('d') and value[:-1].isascii() and value[:-1].isdigit() and int(value[:-1]) > 0:
+        days = int(value[:-1])
+        if days > (today - date.min).days + 1:  # timedelta/date arithmetic would overflow
+            raise ValueError(f"Invalid period: {days} days reaches back before year 1. Use all for lifetime totals.")
+        return today - timedelta(days=days - 1), today, f'last {days} days'
+    try:
+        start_str, _, end_str = value.partition('..')
+        start = date.fromisoformat(start_str)
+        end = date.fromisoformat(end_str) if end_str else start
+    except ValueError:
+        raise ValueError("Invalid period. Use all, 7d, 30d, month, last_month, YYYY-MM-DD or YYYY-MM-DD..YYYY-MM-DD.")
+    if end < start:
+        raise ValueError("Invalid period: the end date is before the start date.")
+    label = start.isoformat() if start == end else f'{start.isoformat()} to {end.isoformat()}'
+    return start, end, label
+
+
+class PingStats:
+    """Columnar lifetime ping counters: a user-id index plus one int32 column per ROLE_THRESHOLDS category.
+
+    The counts live in a single Fortran-ordered matrix, so each category column is contiguous
+    and can be read (or copied for a background export) as a plain numpy view.
+    """
+
+    def __init__(self, categories, capacity: int = 1024):
+        self.categories = list(categories)
+        self.slots = {category: i for i, category in enumerate(self.categories)}
+        self.index = {}  # {user_id: row}
+        self.user_ids = []
+        self.counts = np.zeros((capacity, len(self.categories)), dtype=np.int32, order='F')
+        self.totals = np.zeros(capacity, dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self.index
+
+    def _grow(self):
+        capacity = len(self.totals) * 2
+        counts = np.zeros((capacity, len(self.categories)), dtype=np.int32, order='F')
+        counts[:len(self.totals)] = self.counts
+        totals = np.zeros(capacity, dtype=np.int32)
+        totals[:len(self.totals)] = self.totals
+        self.counts, self.totals = counts, totals
+
+    def _row(self, user_id: str) -> int:
+        row = self.index.get(user_id)
+        if row is None:
+            row = len(self.user_ids)
+            if row == len(self.totals):
+                self._grow()
+            self.index[user_id] = row
+            self.user_ids.append(user_id)
+        return row
+
+    def add(self, user_id: str, category: str, count: int = 1):
+        """Count pings for user_id in category (categories no longer in ROLE_THRESHOLDS only count towards the total)."""
+        row = self._row(user_id)
+        slot = self.slots.get(category)
+        if slot is not None:
+            self.counts[row, slot] += count
+        self.totals[row] += count
+
+    def count(self, user_id: str, category: str) -> int:
+        row = self.index.get(user_id)
+        slot = self.slots.get(category)
+        if row is None or slot is None:
+            return 0
+        return int(self.counts[row, slot])
+
+    def _as_stats(self, row: int) -> dict:
+        return {
+            'total_pings': int(self.totals[row]),
+            'categories': dict(zip(self.categories, self.counts[row].tolist())),
+        }
+
+    def get(self, user_id: str) -> dict | None:
+        """ping_data-shaped stats for one user, or None if they were never counted."""
+        row = self.index.get(user_id)
+        return None if row is None else self._as_stats(row)
+
+    def items(self):
+        """Yield (user_id, stats) in insertion order."""
+        for row, user_id in enumerate(self.user_ids):
+            yield user_id, self._as_stats(row)
+
+    def load_user(self, user_id: str, total: int, categories: dict):
+        """Set one user's counters from stored data."""
+        row = self._row(user_id)
+        self.totals[row] = total
+        for category, count in categories.items():
+            slot = self.slots.get(category)
+            if slot is not None:
+                self.counts[row, slot] = count
+
+    def column(self, category: str | None = None) -> np.ndarray:
+        """View of one category column, or of the totals when category is None."""
+        n = len(self.user_ids)
+        return self.totals[:n] if category is None else self.counts[:n, self.slots[category]]
+
+    def rank(self, user_id: str, category: str | None = None) -> tuple[int, float] | None:
+        """(rank, percentile) of a user, where percentile is the share of users with fewer pings."""
+        row = self.index.get(user_id)
+        if row is None:
+            return None
+        column = self.column(category)
+        value = column[row]
+        return int(np.count_nonzero(column > value)) + 1, float(np.count_nonzero(column < value)) * 100 / len(column)
+
+    def summary(self) -> dict[str, dict]:
+        """Per-category distribution over users with at least one ping in that category."""
+        n = len(self.user_ids)
+        counts = self.counts[:n]
+        sums = counts.sum(axis=0)
+        active = np.count_nonzero(counts, axis=0)
+        result = {}
+        for slot, category in enumerate(self.categories):
+            column = counts[:, slot]
+            nonzero = column[column > 0]
+            p50, p90, p99 = np.percentile(nonzero, [50, 90, 99]) if len(nonzero) else (0, 0, 0)
+            result[category] = {
+                'total': int(sums[slot]),
+                'users': int(active[slot]),
+                'max': int(nonzero.max()) if len(nonzero) else 0,
+                'p50': float(p50),
+                'p90': float(p90),
+                'p99': float(p99),
+            }
+        return result
+
+    def to_columns(self) -> dict:
+        """Columnar, JSON-serializable form used by the snapshot."""
+        n = len(self.user_ids)
+        return {
+            'user_ids': self.user_ids,
+            'total_pings': self.totals[:n].tolist(),
+            'categories': {category: self.counts[:n, slot].tolist() for slot, category in enumerate(self.categories)},
+        }
+
+    def load_columns(self, saved: dict):
+        """Load data written by to_columns, keeping only categories still in ROLE_THRESHOLDS."""
+        user_ids = saved['user_ids']
+        n = len(user_ids)
+        while len(self.totals) < n:
+            self._grow()
+        self.user_ids = list(user_ids)
+        self.index = {user_id: row for row, user_id in enumerate(self.user_ids)}
+        self.totals[:n] = saved['total_pings']
+        for category, column in saved['categories'].items():
+            slot = self.slots.get(category)
+            if slot is not None:
+                self.counts[:n, slot] = column
+
+    def load_users(self, users: dict):
+        """Load the legacy {user_id: {'total_pings', 'categories'}} layout."""
+        for user_id, data in users.items():
+            self.load_user(user_id, data['total_pings'], data['categories'])
+
+    @classmethod
+    def from_bucket_totals(cls, categories, totals: dict[str, array]) -> 'PingStats':
+        """Build a store from PingBuckets.totals() output (rows share the category order)."""
+        stats = cls(categories, capacity=max(len(totals), 1))
+        if totals:
+            stats.user_ids = list(totals)
+            stats.index = {user_id: row for row, user_id in enumerate(stats.user_ids)}
+            stats.counts[:len(totals)] = np.array(list(totals.values()), dtype=np.int32)
+            stats.totals[:len(totals)] = stats.counts[:len(totals)].sum(axis=1)
+        return stats
+
+    def copy(self) -> 'PingStats':
+        """Independent copy, safe to read from a worker thread while the live store keeps counting."""
+        n = len(self.user_ids)
+        clone = PingStats(self.categories, capacity=max(n, 1))
+        clone.user_ids = list(self.user_ids)
+        clone.index = dict(self.index)
+        clone.counts[:n] = self.counts[:n]
+        clone.totals[:n] = self.totals[:n]
+        return clone
+
+
+class Leaderboard:
+    """Users ordered by ping count, kept up to date as pings are counted.
+
+    Users are grouped by their count and the distinct counts are kept sorted, so an
+    increment is a bisect into that list and reading the top K never sorts the user set.
+    """
+
+    def __init__(self):
+        self.scores = {}  # {user_id: count}
+        self.groups = {}  # {count: {user_id: None}} (dict keeps ties in the order they were reached)
+        self.levels = []  # sorted distinct counts
+
+    def _insert(self, user_id: str, score: int):
+        group = self.groups.get(score)
+        if group is None:
+            group = self.groups[score] = {}
+            bisect.insort(self.levels, score)
+        group[user_id] = None
+        self.scores[user_id] = score
+
+    def _remove(self, user_id: str, score: int):
+        group = self.groups[score]
+        del group[user_id]
+        if not group:
+            del self.groups[score]
+            del self.levels[bisect.bisect_left(self.levels, score)]
+
+    def add(self, user_id: str, count: int = 1):
+        """Increase a user's score by count."""
+        score = self.scores.get(user_id)
+        if score is not None:
+            self._remove(user_id, score)
+        self._insert(user_id, (score or 0) + count)
+
+    def top(self, limit: int) -> list[tuple[str, int]]:
+        """The limit highest-scoring users as (user_id, score), best first."""
+        result = []
+        for score in reversed(self.levels):
+            for user_id in self.groups[score]:
+                result.append((user_id, score))
+                if len(result) >= limit:
+                    return result
+        return result
+
+    @classmethod
+    def from_column(cls, user_ids: list[str], column: np.ndarray) -> 'Leaderboard':
+        """Build a leaderboard from a PingStats column (users with no pings are left out)."""
+        board = cls()
+        rows = np.flatnonzero(column)
+        for row in rows[np.argsort(-column[rows], kind='stable')].tolist():
+            board._insert(user_ids[row], int(column[row]))
+        return board
+
+
+def build_leaderboards(stats: PingStats) -> dict[str | None, Leaderboard]:
+    """One leaderboard for total pings (key None) and one per ROLE_THRESHOLDS category."""
+    boards = {None: Leaderboard.from_column(stats.user_ids, stats.column())}
+    for category in stats.categories:
+        boards[category] = Leaderboard.from_column(stats.user_ids, stats.column(category))
+    return boards
+
+
+def iter_lines_reversed(file_path: str, block_size: int = 8192):
+    """Yield the lines of a file from last to first, reading fixed-size blocks backwards from the end."""
+    with open(file_path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        remainder = b''
+        while position > 0:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            lines = (f.read(read_size) + remainder).split(b'\n')
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                if line:
+                    yield line.decode('utf-8', errors='replace')
+        if remainder:
+            yield remainder.decode('utf-8', errors='replace')
+
+
+def command_log_matches(entry: dict, user_id: str | None, command: str | None, start: str | None, end: str | None) -> bool:
+    """Filter for command log entries; start/end are 'YYYY-MM-DD HH:MM:SS' bounds (end exclusive)."""
+    return ((user_id is None or entry['user_id'] == user_id)
+            and (command is None or entry['command'] == command)
+            and (start is None or entry['timestamp'] >= start)
+            and (end is None or entry['timestamp'] < end))
+
+
+class CommandLog:
+    """Append-only JSON-lines command log, written by a background task and rotated by size.
+
+    Files are commands_log.jsonl (newest), then commands_log.jsonl.1 ... .<COMMAND_LOG_BACKUPS>.
+    """
+
+    def __init__(self, file_path: str, max_bytes: int, backups: int):
+        self.file_path = file_path
+        self.max_bytes = max_bytes
+        self.backups = max(1, backups)
+        self.pending = []
+        self.wakeup = None
+        self.task = None
+        self._migrate_legacy()
+
+    def _migrate_legacy(self):
+        """Convert the old whole-file commands_log.json into the JSON-lines log once."""
+        if not os.path.exists(LEGACY_COMMANDS_LOG_FILE) or os.path.exists(self.file_path):
+            return
+        try:
+            with open(LEGACY_COMMANDS_LOG_FILE, 'r') as f:
+                entries = json.load(f)
+        except json.JSONDecodeError:
+            entries = []
+        self._write(entries)
+        os.replace(LEGACY_COMMANDS_LOG_FILE, f"{LEGACY_COMMANDS_LOG_FILE}.migrated")
+        print(f"[LOG] Migrated {len(entries)} entries from {LEGACY_COMMANDS_LOG_FILE} to {self.file_path}")
+
+    def _paths(self) -> list[str]:
+        return [self.file_path] + [f"{self.file_path}.{i}" for i in range(1, self.backups + 1)]
+
+    def _rotate(self):
+        paths = self._paths()
+        for i in range(len(paths) - 1, 0, -1):
+            if os.path.exists(paths[i - 1]):
+                os.replace(paths[i - 1], paths[i])
+
+    def _write(self, entries: list[dict]):
+        if os.path.exists(self.file_path) and os.path.getsize(self.file_path) >= self.max_bytes:
+            self._rotate()
+        with open(self.file_path, 'a', encoding='utf-8') as f:
+            f.writelines(json.dumps(entry) + '\n' for entry in entries)
+
+    def append(self, log_entry: dict):
+        """Queue an entry; never blocks on disk."""
+        self.pending.append(log_entry)
+        if self.task is None or self.task.done():
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.create_task(self._writer())
+        self.wakeup.set()
+
+    async def _writer(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            entries, self.pending = self.pending, []
+            try:
+                await asyncio.to_thread(self._write, entries)
+            except Exception as e:
+                self.pending = entries + self.pending
+                print(f"[LOG] Failed to write command log: {e}")
+                await asyncio.sleep(5)
+                self.wakeup.set()
+
+    def _read_tail(self, limit: int, user_id, command, start, end) -> list[dict]:
+        results = []
+        for path in self._paths():
+            if not os.path.exists(path):
+                continue
+            for line in iter_lines_reversed(path):
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if start is not None and entry['timestamp'] < start:
+                    return results  # everything further back is older still
+                if command_log_matches(entry, user_id, command, start, end):
+                    results.append(entry)
+                    if len(results) >= limit:
+                        return results
+        return results
+
+    async def tail(self, limit: int, user_id=None, command=None, start=None, end=None) -> list[dict]:
+        """Most recent matching entries (oldest first), reading the files backwards from the end."""
+        results = [entry for entry in reversed(self.pending) if command_log_matches(entry, user_id, command, start, end)][:limit]
+        if len(results) < limit:
+            results += await asyncio.to_thread(self._read_tail, limit - len(results), user_id, command, start, end)
+        return list(reversed(results))
+
+    def close(self):
+        """Synchronously write anything still queued."""
+        if self.pending:
+            self._write(self.pending)
+            self.pending = []
+
+
+def read_json_ping_data() -> tuple[PingStats, PingBuckets, int, int]:
+    """Load ping_data.json and replay the journal segments written after it.
+
+    Returns (stats, buckets, next journal segment, events replayed on top of the snapshot).
+    """
+    data = PingStats(CONFIG.role_thresholds)
+    buckets = PingBuckets(CONFIG.role_thresholds)
+    journal_segment = 1
+    replayed = 0
+    saved_buckets = None
+    try:
+        with open(PING_DATA_FILE, 'r') as f:
+            saved_snapshot = json.load(f)
+        if 'journal_segment' in saved_snapshot:
+            if 'stats' in saved_snapshot:
+                data.load_columns(saved_snapshot['stats'])
+            else:
+                data.load_users(saved_snapshot['users'])  # snapshot written before the columnar store
+            journal_segment = saved_snapshot['journal_segment']
+            saved_buckets = saved_snapshot.get('buckets')
+        else:
+            data.load_users(saved_snapshot)  # legacy snapshot written before the journal existed
+    except FileNotFoundError:
+        pass
+
+    if saved_buckets is not None:
+        buckets.load_dict(saved_buckets)
+    else:
+        # Snapshot predates time buckets: rebuild them from the journal history it already covers
+        for segment in list_journal_segments(compressed=True):
+            for event in read_journal_segment(segment, compressed=True):
+                buckets.add(event[1], event[2], event[0])
+        for segment in list_journal_segments():
+            if segment < journal_segment:
+                for event in read_journal_segment(segment):
+                    buckets.add(event[1], event[2], event[0])
+
+    for segment in list_journal_segments():
+        if segment < journal_segment:
+            continue
+        for event in read_journal_segment(segment):
+            data.add(event[1], event[2])
+            buckets.add(event[1], event[2], event[0])
+            replayed += 1
+        # Start a fresh segment so new appends never continue a line torn by a crash
+        journal_segment = segment + 1
+    # Buckets rebuilt from the journal (or started empty) only cover the journal's lifetime
+    buckets.ensure_since()
+    buckets.rollup(bucket_cutoff())
+    return data, buckets, journal_segment, replayed
+
+
+class JsonStorage:
+    """Flat-file backend: ping_data.json snapshot + ping_journal/, commands_log.jsonl and bot_ban_log.txt."""
+
+    def __init__(self):
+        self.command_log = CommandLog(COMMANDS_LOG_FILE, COMMAND_LOG_MAX_BYTES, COMMAND_LOG_BACKUPS)
+        self.data = None  # PingStats and PingBuckets, set by load_ping_data
+        self.buckets = None
+        self.journal_segment = 1  # Segment new events are appended to
+        self.events_since_snapshot = 0
+
+    def load_ping_data(self) -> tuple[PingStats, PingBuckets]:
+        """Load the latest snapshot, then replay the journal segments written after it."""
+        self.data, self.buckets, self.journal_segment, self.events_since_snapshot = read_json_ping_data()
+        if self.events_since_snapshot:
+            print(f"[DATA] Replayed {self.events_since_snapshot} journal events on top of the snapshot")
+        return self.data, self.buckets
+
+    async def flush_pings(self, events: list[tuple], snapshot: bool = False):
+        """Append events to the journal from a worker thread, and write a new snapshot when due."""
+        self.events_since_snapshot += len(events)
+        snapshot = self.events_since_snapshot > 0 and (snapshot or self.events_since_snapshot >= PING_SNAPSHOT_EVERY)
+        if not events and not snapshot:
+            return
+
+        segment = self.journal_segment
+        frozen = None
+        if snapshot:
+            # Everything up to and including `segment` is folded into this snapshot; new events go to the next one.
+            # Only cheap copies are taken on the loop, serializing them happens in the worker thread.
+            self.journal_segment += 1
+            frozen = (self.journal_segment, self.data.copy(), self.buckets.pack())
+
+        if events:
+            try:
+                await asyncio.to_thread(append_journal_events, segment, events)
+            except Exception:
+                self.events_since_snapshot -= len(events)
+                self.journal_segment = segment
+                raise
+
+        if frozen is None:
+            return
+        try:
+            await asyncio.to_thread(write_ping_snapshot, *frozen)
+            self.events_since_snapshot = 0
+            await asyncio.to_thread(compact_journal, self.journal_segment)
+        except Exception as e:
+            # The old snapshot plus the uncompacted segments still replay to the same counters
+            print(f"[DATA] Failed to write ping snapshot: {e}")
+
+    def close(self, events: list[tuple]):
+        """Synchronously persist any events and command log entries still pending after the loop stopped."""
+        if events:
+            append_journal_events(self.journal_segment, events)
+        self.command_log.close()
+
+    async def rollup_buckets(self, cutoff: int):
+        pass  # Buckets are persisted with the next snapshot
+
+    async def log_command(self, log_entry: dict):
+        self.command_log.append(log_entry)
+
+    async def recent_commands(self, limit: int, user_id: str | None = None, command: str | None = None,
+                              start: str | None = None, end: str | None = None) -> list[dict]:
+        return await self.command_log.tail(limit, user_id, command, start, end)
+
+    def _counted_message_keys(self, channel_ids: frozenset, since: int) -> set[tuple[int, int]]:
+        keys = set()
+        for event in iter_journal_events():
+            if event[4] in channel_ids and event[0] >= since:
+                keys.add((event[5], event[3]))
+        return keys
+
+    async def counted_message_keys(self, channel_ids: frozenset, since: int = 0) -> set[tuple[int, int]]:
+        """(message_id, role_id) of every journaled ping in channel_ids at or after since."""
+        return await asyncio.to_thread(self._counted_message_keys, channel_ids, since)
+
+    async def log_moderation(self, log_entry: dict):
+        line = (f"[{log_entry['timestamp']}] User ID: {log_entry['user_id']} ({log_entry['user_name']}) | "
+                f"Action: {log_entry['action']} | Moderator ID: {log_entry['moderator_id']} ({log_entry['moderator_name']})\n")
+        with open(BAN_LOG_FILE, 'a', encoding='utf-8') as f:
+            f.write(line)
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    total_pings INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS category_counts (
+    user_id TEXT NOT NULL,
+    category TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, category)
+);
+CREATE TABLE IF NOT EXISTS ping_events (
+    timestamp INTEGER NOT NULL,
+    user_id TEXT NOT NULL,
+    category TEXT NOT NULL,
+    role_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_ping_events_user_time ON ping_events (user_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_ping_events_message ON ping_events (message_id);
+CREATE INDEX IF NOT EXISTS idx_ping_events_channel ON ping_events (channel_id, timestamp);
+CREATE TABLE IF NOT EXISTS ping_buckets (
+    period TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    user_id TEXT NOT NULL,
+    category TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (period, bucket, user_id, category)
+);
+CREATE TABLE IF NOT EXISTS command_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    username TEXT NOT NULL,
+    command TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_command_log_user ON command_log (user_id, id);
+CREATE INDEX IF NOT EXISTS idx_command_log_command ON command_log (command, id);
+CREATE INDEX IF NOT EXISTS idx_command_log_timestamp ON command_log (timestamp);
+CREATE TABLE IF NOT EXISTS moderation_actions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    user_name TEXT NOT NULL,
+    action TEXT NOT NULL,
+    moderator_id INTEGER NOT NULL,
+    moderator_name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_moderation_actions_user ON moderation_actions (user_id, id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+FLAT_FILE_SOURCES = (PING_DATA_FILE, PING_JOURNAL_DIR, COMMANDS_LOG_FILE, LEGACY_COMMANDS_LOG_FILE, BAN_LOG_FILE)
+BAN_LOG_LINE = re.compile(r'^\[(.+?)\] User ID: (\d+) \((.*)\) \| Action: (.*) \| Moderator ID: (\d+) \((.*)\)$')
+
+
+def read_flat_command_log():
+    """Yield command log entries oldest first: a not yet migrated commands_log.json, then the rotated
+    commands_log.jsonl backups from oldest to newest, then the live file."""
+    if os.path.exists(LEGACY_COMMANDS_LOG_FILE):
+        try:
+            with open(LEGACY_COMMANDS_LOG_FILE, 'r') as f:
+                yield from json.load(f)
+        except json.JSONDecodeError:
+            print(f"[DATA] Skipped {LEGACY_COMMANDS_LOG_FILE}: invalid JSON")
+    backups = [f"{COMMANDS_LOG_FILE}.{i}" for i in range(1, COMMAND_LOG_BACKUPS + 1)]
+    for path in [*reversed(backups), COMMANDS_LOG_FILE]:
+        if not os.path.exists(path):
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+
+def read_ban_log():
+    """Yield moderation_actions rows parsed from bot_ban_log.txt, skipping lines that don't parse."""
+    if not os.path.exists(BAN_LOG_FILE):
+        return
+    with open(BAN_LOG_FILE, 'r', encoding='utf-8') as f:
+        for line in f:
+            match = BAN_LOG_LINE.match(line.rstrip('\n'))
+            if match:
+                timestamp, user_id, user_name, action, moderator_id, moderator_name = match.groups()
+                yield timestamp, int(user_id), user_name, action, int(moderator_id), moderator_name
+
+
+class SqliteStorage:
+    """Single-file SQLite backend (WAL mode). All queries run on one dedicated worker thread."""
+
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite')
+        self.conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.conn is None:
+            conn = sqlite3.connect(self.db_file, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SQLITE_SCHEMA)
+            self.conn = conn
+        return self.conn
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, fn, *args)
+
+    def _load_ping_data(self) -> tuple[PingStats, PingBuckets]:
+        conn = self._connect()
+        if self._is_empty() and any(os.path.exists(path) for path in FLAT_FILE_SOURCES):
+            self._import_json()
+        data = PingStats(CONFIG.role_thresholds)
+        rows = conn.execute(
+            'SELECT u.user_id, u.total_pings, c.category, c.count FROM users u '
+            'LEFT JOIN category_counts c ON c.user_id = u.user_id ORDER BY u.user_id')
+        for user_id, group in itertools.groupby(rows, key=lambda row: row[0]):
+            group = list(group)
+            data.load_user(user_id, group[0][1], {row[2]: row[3] for row in group if row[2] is not None})
+        buckets = PingBuckets(CONFIG.role_thresholds)
+        for row in conn.execute('SELECT period, bucket, user_id, category, count FROM ping_buckets'):
+            buckets.load_row(*row)
+        since = conn.execute("SELECT value FROM meta WHERE key = 'buckets_since'").fetchone()
+        if since is not None:
+            buckets.since = int(since[0])
+        else:
+            buckets.ensure_since()
+            self._set_buckets_since(buckets.since)
+        return data, buckets
+
+    def _set_buckets_since(self, since: int):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('buckets_since', ?)", (str(since),))
+
+    def _is_empty(self) -> bool:
+        return all(self.conn.execute(f'SELECT 1 FROM {table} LIMIT 1').fetchone() is None
+                   for table in ('users', 'ping_events', 'command_log', 'moderation_actions'))
+
+    def _import_json(self):
+        """Seed an empty database from the flat files: ping snapshot + journal, command log and ban log.
+        The files are only read, so switching back to the json backend still finds them as they were."""
+        data, buckets, _, _ = read_json_ping_data()
+        commands = list(read_flat_command_log())
+        with self.conn:
+            self.conn.executemany('INSERT INTO users (user_id, total_pings) VALUES (?, ?)',
+                                  ((user_id, d['total_pings']) for user_id, d in data.items()))
+            self.conn.executemany('INSERT INTO category_counts (user_id, category, count) VALUES (?, ?, ?)',
+                                  ((user_id, category, count) for user_id, d in data.items()
+                                   for category, count in d['categories'].items()))
+            self.conn.executemany('INSERT INTO ping_buckets (period, bucket, user_id, category, count) VALUES (?, ?, ?, ?, ?)',
+                                  buckets.rows())
+            events = self.conn.executemany(
+                'INSERT INTO ping_events (timestamp, user_id, category, role_id, channel_id, message_id) VALUES (?, ?, ?, ?, ?, ?)',
+                (tuple(event) for event in iter_journal_events())).rowcount
+            self.conn.executemany('INSERT INTO command_log (timestamp, user_id, username, command) VALUES (?, ?, ?, ?)',
+                                  ((e['timestamp'], e['user_id'], e['username'], e['command']) for e in commands))
+            actions = self.conn.executemany(
+                'INSERT INTO moderation_actions (timestamp, user_id, user_name, action, moderator_id, moderator_name) '
+                'VALUES (?, ?, ?, ?, ?, ?)', read_ban_log()).rowcount
+        self._set_buckets_since(buckets.since)
+        print(f"[DATA] Imported {len(data)} users, {events} ping events, {len(commands)} command log entries "
+              f"and {actions} moderation actions from the flat files into {self.db_file}")
+
+    def load_ping_data(self) -> tuple[PingStats, PingBuckets]:
+        return self.executor.submit(self._load_ping_data).result()
+
+    def _write_pings(self, events: list[tuple]):
+        if not events:
+            return
+        conn = self._connect()
+        with conn:  # one transaction per batch
+            conn.executemany(
+                'INSERT INTO ping_events (timestamp, user_id, category, role_id, channel_id, message_id) VALUES (?, ?, ?, ?, ?, ?)',
+                events)
+            conn.executemany(
+                'INSERT INTO users (user_id, total_pings) VALUES (?, 1) '
+                'ON CONFLICT (user_id) DO UPDATE SET total_pings = total_pings + 1',
+                ((event[1],) for event in events))
+            conn.executemany(
+                'INSERT INTO category_counts (user_id, category, count) VALUES (?, ?, 1) '
+                'ON CONFLICT (user_id, category) DO UPDATE SET count = count + 1',
+                ((event[1], event[2]) for event in events))
+            conn.executemany(
+                "INSERT INTO ping_buckets (period, bucket, user_id, category, count) VALUES ('day', ?, ?, ?, 1) "
+                'ON CONFLICT (period, bucket, user_id, category) DO UPDATE SET count = count + 1',
+                ((day_key(datetime.fromtimestamp(event[0], timezone.utc).date()), event[1], event[2]) for event in events))
+
+    async def flush_pings(self, events: list[tuple], snapshot: bool = False):
+        # Counters are updated in the same transaction as the events, so there is no separate snapshot
+        await self._run(self._write_pings, events)
+
+    def close(self, events: list[tuple]):
+        self.executor.submit(self._write_pings, events).result()
+        if self.conn is not None:
+            self.executor.submit(self.conn.close).result()
+        self.executor.shutdown()
+
+    def _rollup_buckets(self, cutoff: int):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO ping_buckets (period, bucket, user_id, category, count) "
+                "SELECT 'month', bucket / 100, user_id, category, SUM(count) FROM ping_buckets "
+                "WHERE period = 'day' AND bucket < ? GROUP BY bucket / 100, user_id, category "
+                'ON CONFLICT (period, bucket, user_id, category) DO UPDATE SET count = count + excluded.count',
+                (cutoff,))
+            conn.execute("DELETE FROM ping_buckets WHERE period = 'day' AND bucket < ?", (cutoff,))
+
+    async def rollup_buckets(self, cutoff: int):
+        await self._run(self._rollup_buckets, cutoff)
+
+    def _log_command(self, log_entry: dict):
+        with self._connect() as conn:
+            conn.execute('INSERT INTO command_log (timestamp, user_id, username, command) VALUES (?, ?, ?, ?)',
+                         (log_entry['timestamp'], log_entry['user_id'], log_entry['username'], log_entry['command']))
+
+    async def log_command(self, log_entry: dict):
+        await self._run(self._log_command, log_entry)
+
+    def _recent_commands(self, limit: int, user_id, command, start, end) -> list[dict]:
+        clauses, params = [], []
+        for clause, value in (('user_id = ?', user_id), ('command = ?', command), ('timestamp >= ?', start), ('timestamp < ?', end)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        where = f"WHERE {' AND '.join(clauses)} " if clauses else ''
+        rows = self._connect().execute(
+            f'SELECT user_id, username, command, timestamp FROM command_log {where}ORDER BY id DESC LIMIT ?',
+            (*params, limit)).fetchall()
+        return [{'user_id': r[0], 'username': r[1], 'command': r[2], 'timestamp': r[3]} for r in reversed(rows)]
+
+    async def recent_commands(self, limit: int, user_id: str | None = None, command: str | None = None,
+                              start: str | None = None, end: str | None = None) -> list[dict]:
+        return await self._run(self._recent_commands, limit, user_id, command, start, end)
+
+    def _log_moderation(self, log_entry: dict):
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO moderation_actions (timestamp, user_id, user_name, action, moderator_id, moderator_name) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (log_entry['timestamp'], log_entry['user_id'], log_entry['user_name'], log_entry['action'],
+                 log_entry['moderator_id'], log_entry['moderator_name']))
+
+    async def log_moderation(self, log_entry: dict):
+        await self._run(self._log_moderation, log_entry)
+
+    def _counted_message_keys(self, channel_ids: frozenset, since: int) -> set[tuple[int, int]]:
+        placeholders = ', '.join('?' * len(channel_ids))
+        rows = self._connect().execute(
+            f'SELECT message_id, role_id FROM ping_events WHERE channel_id IN ({placeholders}) AND timestamp >= ?',
+            (*channel_ids, since))
+        return set(rows)
+
+    async def counted_message_keys(self, channel_ids: frozenset, since: int = 0) -> set[tuple[int, int]]:
+        return await self._run(self._counted_message_keys, channel_ids, since)
+
+
+if STORAGE_BACKEND == 'sqlite':
+    storage = SqliteStorage(SQLITE_DB_FILE)
+elif STORAGE_BACKEND == 'json':
+    storage = JsonStorage()
+else:
+    raise ValueError(f"Unknown STORAGE_BACKEND '{STORAGE_BACKEND}' (expected 'json' or 'sqlite').")
+
+# Loaded by load_state() when the bot starts
+ping_data: PingStats | None = None
+ping_buckets: PingBuckets | None = None
+leaderboards: dict[str | None, Leaderboard] = {}
+pending_pings = []  # Events counted in ping_data but not yet handed to the storage backend
+
+OPEN_WARNINGS_FILE = 'open_warnings.jsonl'
+LEGACY_OPEN_WARNINGS_FILE = 'open_warnings.json'  # Whole-map format written by older versions
+WARNING_BAN_WINDOW = 10  # Seconds after a warning during which a ban edits it
+
+
+class WarningStore:
+    """Open MD5 warnings by message id ({member_id, channel_id, created, content}), persisted so their
+    buttons keep working after a restart. Entries are dropped once a moderator acts on them, once the
+    warning message is deleted, and once they are older than WARNING_MAX_AGE.
+
+    The file is an append-only log of {"add": id, ...} and {"drop": id} lines, so a change costs one
+    appended line. It is rewritten with only the open warnings at load and whenever dropped lines make up
+    most of it, keeping it proportional to the open warnings.
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.warnings = {}
+        self.by_member = {}  # member id -> message id of their latest warning
+        self.pending = {}  # member id -> [queued at, who banned them or None] for warnings not sent yet
+        self.log_lines = 0  # lines in the file, open or dropped
+        self._save_lock = asyncio.Lock()
+
+    def load(self):
+        try:
+            with open(self.file_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # torn final line
+                    if 'drop' in entry:
+                        self.warnings.pop(entry['drop'], None)
+                    else:
+                        message_id = entry.pop('add')
+                        self.warnings[message_id] = entry
+        except FileNotFoundError:
+            try:
+                with open(LEGACY_OPEN_WARNINGS_FILE, 'r', encoding='utf-8') as f:
+                    self.warnings = {int(message_id): data for message_id, data in json.load(f).items()}
+            except (FileNotFoundError, json.JSONDecodeError):
+                pass
+        self.by_member = {data['member_id']: message_id for message_id, data in sorted(self.warnings.items())}
+        expired = self.prune()
+        if expired:
+            print(f"[ICON] Dropped {len(expired)} open warnings older than {WARNING_MAX_AGE / 86400:g} days")
+        self._compact()
+        if os.path.exists(LEGACY_OPEN_WARNINGS_FILE):
+            os.remove(LEGACY_OPEN_WARNINGS_FILE)
+
+    def get(self, message_id: int) -> dict | None:
+        return self.warnings.get(message_id)
+
+    def has_open(self, member_id: int) -> bool:
+        """True if member has an open warning, sent or still queued."""
+        return member_id in self.by_member or member_id in self.pending
+
+    def queue(self, member_id: int):
+        """Note a warning queued for member, so a ban landing before it is sent is not missed."""
+        self.pending[member_id] = [time.time(), None]
+
+    def note_ban(self, member_id: int, banned_by_name: str) -> bool:
+        """Remember who banned member if their warning is still queued. Returns False if none is."""
+        entry = self.pending.get(member_id)
+        if entry is None:
+            return False
+        entry[1] = banned_by_name
+        return True
+
+    def awaiting_ban(self, member_id: int) -> bool:
+        """True if a ban of member now would edit a warning: a recent one or one still queued."""
+        return member_id in self.pending or self.recent(member_id) is not None
+
+    def recent(self, member_id: int) -> tuple[int, dict] | None:
+        """(message id, warning) for member's warning if it was posted within WARNING_BAN_WINDOW seconds."""
+        message_id = self.by_member.get(member_id)
+        if message_id is None:
+            return None
+        data = self.warnings[message_id]
+        if time.time() - data['created'] > WARNING_BAN_WINDOW:
+            return None
+        return message_id, data
+
+    async def add(self, message: discord.Message, member_id: int):
+        data = {'member_id': member_id, 'channel_id': message.channel.id,
+                'created': time.time(), 'content': message.content}
+        self.warnings[message.id] = data
+        self.by_member[member_id] = message.id
+        dropped = self.prune()
+        await self._log([{'add': message.id, **data}] + [{'drop': message_id} for message_id in dropped])
+
+    def prune(self) -> list[int]:
+        """Forget warnings older than WARNING_MAX_AGE. Returns their message ids."""
+        cutoff = time.time() - WARNING_MAX_AGE
+        stale = [message_id for message_id, data in self.warnings.items() if data['created'] < cutoff]
+        self._forget(stale)
+        # Queued warnings whose send failed for good never reach add()
+        for member_id in [m for m, (queued_at, _) in self.pending.items() if queued_at < cutoff]:
+            del self.pending[member_id]
+        return stale
+
+    async def resolve(self, *message_ids: int):
+        """Drop the warnings with these message ids (ids that aren't open are ignored)."""
+        dropped = self._forget(message_ids)
+        if dropped:
+            await self._log([{'drop': message_id} for message_id in dropped])
+
+    def _forget(self, message_ids) -> list[int]:
+        dropped = []
+        for message_id in message_ids:
+            data = self.warnings.pop(message_id, None)
+            if data is None:
+                continue
+            if self.by_member.get(data['member_id']) == message_id:
+                del self.by_member[data['member_id']]
+            dropped.append(message_id)
+        return dropped
+
+    async def _log(self, entries: list[dict]):
+        async with self._save_lock:
+            if self.log_lines + len(entries) > 2 * len(self.warnings) + 100:
+                # Mostly dropped lines by now: rewrite with just the open warnings (which include these changes)
+                payload, count = self._open_lines()
+                await asyncio.to_thread(write_text_atomic, self.file_path, payload)
+                self.log_lines = count
+            else:
+                await asyncio.to_thread(append_lines, self.file_path, [json.dumps(entry) for entry in entries])
+                self.log_lines += len(entries)
+
+    def _open_lines(self) -> tuple[str, int]:
+        """The log rewritten with only the open warnings, and its line count."""
+        lines = [json.dumps({'add': message_id, **data}) + '\n' for message_id, data in self.warnings.items()]
+        return ''.join(lines), len(lines)
+
+    def _compact(self):
+        payload, self.log_lines = self._open_lines()
+        write_text_atomic(self.file_path, payload)
+
+
+warning_store = WarningStore(OPEN_WARNINGS_FILE)
+
+# Serializes flushes to the storage backend
+ping_data_flush_lock = asyncio.Lock()
+
+def record_ping(message: discord.Message, role_id: int, category: str):
+    """Count a ping and queue its event for the storage backend."""
+    author_id = str(message.author.id)
+    timestamp = int(message.created_at.timestamp())
+    ping_data.add(author_id, category)
+    ping_buckets.add(author_id, category, timestamp)
+    leaderboards[None].add(author_id)
+    if category in leaderboards:
+        leaderboards[category].add(author_id)
+    pending_pings.append((timestamp, author_id, category, role_id, message.channel.id, message.id))
 
 # Save data function
 async def save_data():
-    with open('ping_data.json', 'w') as f:
-        json.dump(ping_data, f)
+    """Flush once enough events are pending; otherwise the interval task picks them up."""
+    if len(pending_pings) >= PING_FLUSH_MAX_CHANGES:
+        await flush_ping_data()
 
-@bot.event
-async def on_ready():
-    print(f'Bot is ready as {bot.user}')
+async def flush_ping_data(snapshot: bool = False):
+    """Hand pending ping events to the storage backend in one batch."""
+    global pending_pings
+    async with ping_data_flush_lock:
+        events, pending_pings = pending_pings, []
+        try:
+            await storage.flush_pings(events, snapshot)
+        except Exception as e:
+            pending_pings = events + pending_pings
+            print(f"[DATA] Failed to flush ping data: {e}")
+
+async def get_user_stats(user_id: str, period: tuple[date, date, str] | None = None) -> dict | None:
+    """Stats for one user: lifetime from ping_data, which already counts pending events whatever the backend,
+    or from the time buckets. Neither touches disk, so repeating the command costs no I/O."""
+    if period:
+        return ping_buckets.user_stats(user_id, period[0], period[1])
+    return ping_data.get(user_id)
+
+async def rollup_ping_buckets():
+    """Roll day buckets older than PING_BUCKET_DAYS into months, in memory and in the backend."""
+    cutoff = bucket_cutoff()
+    if ping_buckets.rollup(cutoff):
+        await storage.rollup_buckets(cutoff)
+
+@tasks.loop(seconds=PING_FLUSH_INTERVAL)
+async def flush_ping_data_task():
+    """Periodically flush pending ping_data changes and roll up old time buckets."""
+    await flush_ping_data()
+    await rollup_ping_buckets()
+
+async def graceful_shutdown():
+    """Flush pending data and close the bot."""
+    await flush_ping_data(snapshot=True)
+    await bot.close()
+
+shutdown_task = None  # Kept referenced so the loop can't garbage collect it mid-flush
+
+def on_sigterm():
+    """Start the graceful shutdown once; repeated SIGTERMs while it runs are ignored."""
+    global shutdown_task
+    if shutdown_task is not None:
+        print("[DATA] Shutdown already in progress, ignoring SIGTERM")
+        return
+    shutdown_task = asyncio.create_task(graceful_shutdown())
+
+def install_signal_handlers():
+    """Flush and close cleanly on SIGTERM (no-op where the loop does not support signal handlers)."""
+    loop = asyncio.get_running_loop()
     try:
-        synced = await bot.tree.sync()  # register slash commands with Discord
-        print(f"Synced {len(synced)} slash commands.")
-    except Exception as e:
-        print(f"Failed to sync commands: {e}")
-    
-    # Re-add persistent views for any active warning messages
+        loop.add_signal_handler(signal.SIGTERM, on_sigterm)
+    except (NotImplementedError, RuntimeError):
+        print("[DATA] SIGTERM handler not supported on this platform")
+
+COMMAND_SYNC_FILE = 'command_sync.json'  # Fingerprint of the last command tree synced to Discord
+
+
+def command_tree_fingerprint() -> str:
+    """SHA-256 of the local slash command tree as Discord sees it (names, descriptions, options, choices)."""
+    payload = sorted((command.to_dict(bot.tree) for command in bot.tree.get_commands()), key=lambda c: c['name'])
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+async def sync_command_tree(force: bool = False) -> int | None:
+    """Sync slash commands with Discord if the tree changed since the last sync (or always with force).
+
+    Returns the number of synced commands, or None if the sync was skipped.
+    """
+    fingerprint = command_tree_fingerprint()
     try:
-        for user_id, warning_data in list(recent_warnings.items()):
-            if 'member' in warning_data:
-                member = warning_data['member']
-                bot.add_view(MD5ResponseView(member))
-                print(f"[ICON] Re-attached view for warning message user {user_id}")
-    except Exception as e:
-        print(f"[ICON] Error re-attaching views on ready: {e}")
-    
-    # Start the presence update task
-    if not update_presence.is_running():
-        update_presence.start()
-        print("[PRESENCE] Uptime presence task started")
-    
-    # Start the periodic ban check task
-    if not check_recent_bans.is_running():
-        check_recent_bans.start()
-        print("[ICON] Periodic ban check task started")
+        with open(COMMAND_SYNC_FILE, 'r', encoding='utf-8') as f:
+            last = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        last = {}
+    if not force and last.get('fingerprint') == fingerprint and last.get('application_id') == bot.application_id:
+        print(f"Slash commands unchanged since {last.get('synced_at')}, skipping sync.")
+        return None
+
+    synced = await bot.tree.sync()  # register slash commands with Discord
+    write_text_atomic(COMMAND_SYNC_FILE, json.dumps({
+        'fingerprint': fingerprint,
+        'application_id': bot.application_id,
+        'synced_at': datetime.now(timezone.utc).isoformat(),
+    }, indent=2))
+    print(f"Synced {len(synced)} slash commands.")
+    return len(synced)
+
+
+def start_background_tasks():
+    """Start the periodic tasks. Runs once from setup_hook, not on every (re)connect."""
+    global seed_avatar_task
+    # Start the write-behind flush task and hook SIGTERM once
+    flush_ping_data_task.start()
+    install_signal_handlers()
+    print("[DATA] Ping data flush task started")
+
+    # Start the presence update task (it waits for the gateway before its first update)
+    update_presence.start()
+    print("[PRESENCE] Uptime presence task started")
+
+    # Watch list.txt for hand edits
+    reload_blocklist_task.start()
+    print("[ICON] Blocklist reload task started")
+
+    # Watch .conf for hand edits
+    reload_config_task.start()
+    print("[CONFIG] Config reload task started")
+
+    # Pin the default avatar hashes; the task is kept referenced so it can't be garbage collected mid-run
+    seed_avatar_task = asyncio.create_task(seed_default_avatar_hashes())
     #  monthly_report.start()
 
+@bot.event
+async def on_ready():
+    print(f'Bot is ready as {bot.user}')
+
+def tracked_pings(message: discord.Message) -> list[tuple[int, str]]:
+    """(role_id, category) for every tracked role the message mentions."""
+    role_category = CONFIG.role_category
+    return [(role.id, role_category[role.id]) for role in message.role_mentions if role.id in role_category]
+
 @bot.event
 async def on_message(message):
-    if message.channel.id not in LFG_CHANNEL_IDS:
+    if message.channel.id not in CONFIG.lfg_channel_set:
         return
 
-    author_id = str(message.author.id)
-    
-    # Initialize user data if not exists
-    if author_id not in ping_data:
-        ping_data[author_id] = {
-            'total_pings': 0,
-            'categories': {
-                'Ultra_rares': 0,
-                'ID_sharing': 0,
-                'Rares': 0,
-                'Dungeons': 0,
-                'Raids': 0,
-                'Mythic_raids': 0,
-                'Glory_runs': 0,
-                'World_events': 0,
-                'Secret(:': 0
-            }
-        }
+    # Resolve tracked role mentions up front so untracked messages cost nothing
+    pinged = tracked_pings(message)
+    if not pinged:
+        return
 
     # Update ping counts based on role mentions
-    for role in message.role_mentions:
-        role_id = role.id
-        # Check which role category was pinged
-        for category, data in ROLE_THRESHOLDS.items():
-            if role_id in data['role_id']:  # Changed from == to in to check list membership
-                ping_data[author_id]['categories'][category] += 1
-                ping_data[author_id]['total_pings'] += 1
-                break  # Break to avoid counting the same ping multiple times
+    for role_id, category in pinged:
+        record_ping(message, role_id, category)
     
-    # Check thresholds
-    await check_thresholds(message.author, ping_data[author_id])
+    # Check thresholds (only for the categories this message touched)
+    await check_thresholds(message.author, {category for _, category in pinged})
     await save_data()
     await bot.process_commands(message)
 
-async def check_thresholds(user, user_data):
-    channel = bot.get_channel(PING_LOG_CHANNEL_ID)
-    if not channel:
-        return
+# Outbound notifications: one sender per channel, so bursts queue up and merge instead of stalling handlers
+PRIORITY_MODERATION = 0
+PRIORITY_MILESTONE = 1
+DISCORD_MESSAGE_LIMIT = 2000
+
+
+class OutboundNotifier:
+    """Per-channel outbound message queues.
+
+    post() never blocks: it queues the message and makes sure the channel's sender task is running.
+    Each sender sends one message at a time, highest priority first (moderation warnings before
+    milestones), so discord.py's rate limiting delays only the sender, never the event handlers.
+    Messages with a view go out on their own. Plain low-priority messages are held for
+    NOTIFY_COALESCE_DELAY seconds and merged into digest messages of up to 2000 characters.
+    Resolved channels are cached.
+    """
+
+    def __init__(self):
+        self.queues = {}  # channel id -> heap of (priority, seq, content, view, on_sent)
+        self.senders = {}  # channel id -> sender task
+        self.channels = {}  # channel id -> resolved channel
+        self.sequence = itertools.count()
+
+    def post(self, channel_id: int, content: str, priority: int = PRIORITY_MILESTONE, view: discord.ui.View | None = None, on_sent=None):
+        """Queue content for channel_id. on_sent(message) is awaited once it has been delivered."""
+        heapq.heappush(self.queues.setdefault(channel_id, []), (priority, next(self.sequence), content, view, on_sent))
+        sender = self.senders.get(channel_id)
+        if sender is None or sender.done():
+            self.senders[channel_id] = asyncio.create_task(self._send_loop(channel_id))
+
+    async def resolve_channel(self, channel_id: int) -> discord.abc.Messageable | None:
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            channel = bot.get_channel(channel_id)
+            if channel is None:
+                try:
+                    channel = await bot.fetch_channel(channel_id)
+                except Exception as e:
+                    print(f"[NOTIFY] failed to fetch channel {channel_id}: {e}")
+                    return None
+            if not isinstance(channel, discord.TextChannel):
+                print(f"[NOTIFY] channel {channel_id} resolved to non-text channel: {type(channel)}")
+                return None
+            self.channels[channel_id] = channel
+        return channel
+
+    def _next_batch(self, queue: list) -> list:
+        """Pop the next message to send: the top entry, plus queued plain messages of the same priority
+        merged into it up to the message length limit."""
+        batch = [heapq.heappop(queue)]
+        priority, _, content, view, _ = batch[0]
+        if view is not None:
+            return batch
+        length = len(content)
+        while queue and queue[0][0] == priority and queue[0][3] is None and length + 1 + len(queue[0][2]) <= DISCORD_MESSAGE_LIMIT:
+            length += 1 + len(queue[0][2])
+            batch.append(heapq.heappop(queue))
+        return batch
+
+    async def _send_loop(self, channel_id: int):
+        queue = self.queues[channel_id]
+        channel = await self.resolve_channel(channel_id)
+        if channel is None:
+            print(f"[NOTIFY] dropping {len(queue)} queued messages for channel {channel_id}")
+            queue.clear()
+            return
+        attempt = 0
+        while queue:
+            if queue[0][0] != PRIORITY_MODERATION and queue[0][3] is None:
+                await asyncio.sleep(NOTIFY_COALESCE_DELAY)  # let the rest of a burst arrive
+            batch = self._next_batch(queue)
+            _, _, _, view, on_sent = batch[0]
+            try:
+                message = await channel.send('\n'.join(entry[2] for entry in batch), view=view)
+            except Exception as e:
+                # Rate limits, 5xx and connection errors/timeouts are retried; anything else drops the batch.
+                # Either way the loop keeps going, so the rest of the queue is still delivered.
+                if isinstance(e, discord.HTTPException):
+                    transient = e.status == 429 or e.status >= 500
+                else:
+                    transient = isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError, OSError))
+                if transient and attempt < HTTP_RETRIES:
+                    for entry in batch:
+                        heapq.heappush(queue, entry)
+                    attempt += 1
+                    await asyncio.sleep(retry_delay(attempt))
+                    continue
+                print(f"[NOTIFY] failed to send {len(batch)} queued messages to channel {channel_id}, dropping them: {e!r}")
+                attempt = 0
+                continue
+            attempt = 0
+            if on_sent is not None:
+                try:
+                    await on_sent(message)
+                except Exception as e:
+                    print(f"[NOTIFY] post-send hook failed for channel {channel_id}: {e}")
+
+    def pending(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+
+notifier = OutboundNotifier()
 
-    for category, data in ROLE_THRESHOLDS.items():
-        if user_data['categories'][category] == data['threshold']:
+
+async def check_thresholds(user, categories=None):
+    for category, data in CONFIG.role_thresholds.items():
+        if categories is not None and category not in categories:
+            continue
+        if ping_data.count(str(user.id), category) == data['threshold']:
             # Send notification for each role in the category
             for role_id in data['role_id']:
                 role = user.guild.get_role(role_id)
                 if role:
-                    await channel.send(f'🎉 {user.mention} has reached {data["threshold"]} {category} role pings!')
+                    notifier.post(CONFIG.ping_log_channel_id, f'🎉 {user.mention} has reached {data["threshold"]} {category} role pings!')
                     break  # Send only one notification per threshold reached
 
+# History backfill: recount pings from LFG channel history, resumable and idempotent
+BACKFILL_CHECKPOINT_FILE = 'backfill_checkpoint.json'
+BACKFILL_CHECKPOINT_EVERY = 500  # Messages per channel between checkpoints
+backfill_task = None
+backfill_checkpoint_lock = asyncio.Lock()
+
+
+def load_backfill_checkpoint() -> dict | None:
+    try:
+        with open(BACKFILL_CHECKPOINT_FILE, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+async def save_backfill_checkpoint(checkpoint: dict):
+    """Persist progress; events are flushed first so the checkpoint never claims pings the backend lacks."""
+    async with backfill_checkpoint_lock:
+        await flush_ping_data()
+        await asyncio.to_thread(write_text_atomic, BACKFILL_CHECKPOINT_FILE, json.dumps(checkpoint))
+
+
+def backfill_floors(categories: list[str]) -> dict[str, int | None]:
+    """Oldest timestamp a backfill may credit for each category (None: the whole history).
+
+    Pings that were counted before the journal existed (legacy snapshots) have no message record, so they
+    can't be told apart from uncounted ones. A category whose lifetime total is larger than its time buckets
+    holds such pings, and is only backfilled from the day after the buckets start; categories whose every
+    ping is on record (e.g. one just added to ROLE_THRESHOLDS) are backfilled over the whole history.
+    """
+    bucketed = ping_buckets.category_totals()
+    boundary = datetime.combine(ping_buckets.since_day() + timedelta(days=1), datetime.min.time(), timezone.utc)
+    floors = {}
+    for category in categories:
+        unrecorded = int(ping_data.column(category).sum()) - bucketed.get(category, 0)
+        floors[category] = int(boundary.timestamp()) if unrecorded > 0 else None
+    return floors
+
+
+async def backfill_channel(channel_id: int, checkpoint: dict, seen: set, semaphore: asyncio.Semaphore):
+    """Walk one channel's history backwards from its checkpoint, counting pings not seen before in the
+    checkpoint's categories (each no older than its floor)."""
+    state = checkpoint['channels'].setdefault(str(channel_id), {'oldest_id': checkpoint['before'], 'scanned': 0, 'counted': 0, 'done': False})
+    if state['done']:
+        return
+
+    async with semaphore:
+        channel = bot.get_channel(channel_id) or await bot.fetch_channel(channel_id)
+        after = discord.Object(id=checkpoint['after']) if checkpoint['after'] else None
+        floors = checkpoint.get('floors')  # None for checkpoints written before category filtering
+        since_checkpoint = 0
+        async for message in channel.history(limit=None, before=discord.Object(id=state['oldest_id']), after=after, oldest_first=False):
+            timestamp = message.created_at.timestamp()
+            for role_id, category in tracked_pings(message):
+                if floors is not None and (category not in floors or (floors[category] or 0) > timestamp):
+                    continue
+                key = (message.id, role_id)
+                if key in seen:
+                    continue
+                seen.add(key)
+                record_ping(message, role_id, category)
+                state['counted'] += 1
+            state['oldest_id'] = message.id
+            state['scanned'] += 1
+            since_checkpoint += 1
+            if since_checkpoint >= BACKFILL_CHECKPOINT_EVERY:
+                await save_backfill_checkpoint(checkpoint)
+                since_checkpoint = 0
+        state['done'] = True
+        await save_backfill_checkpoint(checkpoint)
+        print(f"[BACKFILL] Channel {channel_id} done: {state['scanned']} messages scanned, {state['counted']} pings counted")
+
+
+async def run_backfill(checkpoint: dict):
+    """Backfill every LFG channel concurrently (bounded by BACKFILL_CONCURRENCY)."""
+    since = discord.utils.snowflake_time(checkpoint['after']).timestamp() if checkpoint['after'] else 0
+    channel_ids = CONFIG.lfg_channel_ids
+    seen = await storage.counted_message_keys(frozenset(channel_ids), int(since))
+    seen.update((event[5], event[3]) for event in pending_pings)
+    semaphore = asyncio.Semaphore(BACKFILL_CONCURRENCY)
+    results = await asyncio.gather(
+        *(backfill_channel(channel_id, checkpoint, seen, semaphore) for channel_id in channel_ids),
+        return_exceptions=True
+    )
+    for channel_id, result in zip(channel_ids, results):
+        if isinstance(result, asyncio.CancelledError):
+            raise result
+        if isinstance(result, Exception):
+            print(f"[BACKFILL] Channel {channel_id} failed: {result}")
+    await save_backfill_checkpoint(checkpoint)
+
+
+def format_backfill_floors(floors: dict[str, int | None] | None) -> str:
+    if floors is None:
+        return "all categories"
+    return ", ".join(f"{category} (since {datetime.fromtimestamp(floor, timezone.utc).date().isoformat()})" if floor else category
+                     for category, floor in floors.items())
+
+
+def format_backfill_status(checkpoint: dict | None) -> str:
+    if not checkpoint:
+        return "No backfill has been run."
+    running = backfill_task is not None and not backfill_task.done()
+    lines = [f"Backfill {'running' if running else 'stopped'} for {format_backfill_floors(checkpoint.get('floors'))}:"]
+    for channel_id in CONFIG.lfg_channel_ids:
+        state = checkpoint['channels'].get(str(channel_id))
+        if not state:
+            lines.append(f"<#{channel_id}>: pending")
+        else:
+            status = "done" if state['done'] else "in progress"
+            lines.append(f"<#{channel_id}>: {status} — {state['scanned']} messages scanned, {state['counted']} pings counted")
+    return "\n".join(lines)
+
+
 @tasks.loop(seconds=30)  # Update presence every 30 seconds
 async def update_presence():
     """Update bot presence to show current uptime."""
@@ -178,113 +1981,872 @@ async def update_presence():
     except Exception as e:
         print(f"[PRESENCE] Error updating presence: {e}")
 
-@tasks.loop(seconds=1)  # Check for bans every 1 second
-async def check_recent_bans():
-    """Periodically check if users in recent_warnings have been banned."""
-    try:
-        for user_id, warning_data in list(recent_warnings.items()):
-            elapsed = (datetime.now(timezone.utc) - warning_data["timestamp"]).total_seconds()
-            
-            # Stop checking after 10 seconds
-            if elapsed > 10:
-                recent_warnings.pop(user_id, None)
-                continue
-            
-            # Check if user is still in the guild
-            member = warning_data.get("member")
-            if member and member.guild:
-                try:
-                    # Try to fetch the user from the guild
-                    fetched_member = await member.guild.fetch_member(user_id)
-                except discord.NotFound:
-                    # User is no longer in the guild (likely banned/removed)
-                    # Check the audit log to find who banned them
-                    try:
-                        async for entry in member.guild.audit_logs(limit=10, action=discord.AuditLogAction.ban):
-                            if entry.target.id == user_id:
-                                await handle_user_banned(user_id, str(entry.user))
-                                print(f"[ICON] Detected ban for user {user_id} by {entry.user} (via periodic check)")
-                                break
-                    except Exception as e:
-                        print(f"[ICON] Failed to check audit log in periodic check: {e}")
-                    # Clean up even if we couldn't find the audit log entry
-                    recent_warnings.pop(user_id, None)
-                except Exception as e:
-                    print(f"[ICON] Error checking member {user_id} in periodic ban check: {e}")
-    except Exception as e:
-        print(f"[ICON] Error in periodic ban check task: {e}")
+@update_presence.before_loop
+async def before_update_presence():
+    await bot.wait_until_ready()
 
 @tasks.loop(hours=24*30)  # Monthly report
 async def monthly_report():
-    channel = bot.get_channel(PING_LOG_CHANNEL_ID)
+    channel = bot.get_channel(CONFIG.ping_log_channel_id)
     if not channel:
         return
 
-    report = "Monthly Ping Report \n\n"
-    
-    for user_id, data in ping_data.items():
-        user = bot.get_user(int(user_id))
-        if user:
-            report += f"{user.name}:\n"
-            report += f"Total pings: {data['total_pings']}\n"
-            for category, count in data['categories'].items():
-                report += f"{category}: {count}\n"
-            report += "\n"
+    start, end, label = parse_period('last_month')
+    stats = PingStats.from_bucket_totals(CONFIG.role_thresholds, ping_buckets.totals(start, end))
+    report = ReportPaginator(f"Monthly Ping Report ({label})", stats, format_summary(stats))
+
+    # Large reports go out as the first page plus the full file; small ones as one message per page
+    if len(stats) > REPORT_FILE_THRESHOLD:
+        await channel.send(embed=report.render(0), file=await build_report_file(report.title, stats))
+        return
+    for page in range(report.page_count):
+        await channel.send(embed=report.render(page))
+
+# Shared HTTP session for avatar downloads (one connection pool + DNS cache for the whole process)
+http_session: aiohttp.ClientSession | None = None
+RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+def open_http_session() -> aiohttp.ClientSession:
+    """Return the shared session, creating it (pooled, DNS-cached, keep-alive) if needed."""
+    global http_session
+    if http_session is None or http_session.closed:
+        connector = aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, ttl_dns_cache=300, keepalive_timeout=60)
+        timeout = aiohttp.ClientTimeout(connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_READ_TIMEOUT)
+        http_session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    return http_session
+
+
+async def close_http_session():
+    global http_session
+    if http_session is not None and not http_session.closed:
+        await http_session.close()
+    http_session = None
+
+
+RETRY_AFTER_MAX = 60  # Seconds; a longer Retry-After is not waited out in full
+
+
+def retry_delay(attempt: int, resp: aiohttp.ClientResponse | None = None) -> float:
+    """Exponential backoff with jitter, honouring Retry-After (up to RETRY_AFTER_MAX) when the server sends one."""
+    if resp is not None and resp.headers.get('Retry-After'):
+        try:
+            delay = float(resp.headers['Retry-After'])
+        except ValueError:
+            delay = -1
+        if delay >= 0:
+            return min(delay, RETRY_AFTER_MAX)
+    return 0.5 * 2 ** attempt + random.uniform(0, 0.25)
+
+
+class AvatarDigest:
+    """Incremental MD5 of an avatar download; keeps the bytes only when asked to (for perceptual hashing)."""
+
+    def __init__(self, keep_bytes: bool = False):
+        self.md5 = hashlib.md5()
+        self.data = bytearray() if keep_bytes else None
+        self.size = 0
 
-    await channel.send(report)
+    def update(self, chunk: bytes):
+        self.md5.update(chunk)
+        self.size += len(chunk)
+        if self.data is not None:
+            self.data += chunk
 
-async def get_avatar_md5(avatar_url: str | None) -> str | None:
-    """Fetch avatar asynchronously and compute MD5 hash. Returns None on failure."""
+    def hexdigest(self) -> str:
+        return self.md5.hexdigest()
+
+
+async def download_avatar(avatar_url: str | None, keep_bytes: bool = False) -> tuple[AvatarDigest | None, str | None]:
+    """Stream an avatar through the shared session, hashing chunks as they arrive.
+
+    Transient failures are retried. A body larger than AVATAR_MAX_BYTES aborts the download. Returns
+    (digest, None) on success or (None, reason) with why it failed: timeout, too large, HTTP status, ...
+    """
     if not avatar_url:
+        return None, 'no avatar'
+    session = open_http_session()
+    reason = None
+    for attempt in range(HTTP_RETRIES):
+        last_attempt = attempt == HTTP_RETRIES - 1
+        try:
+            async with session.get(avatar_url) as resp:
+                if resp.status == 200:
+                    if resp.content_length and resp.content_length > AVATAR_MAX_BYTES:
+                        return None, f'too large ({resp.content_length} bytes)'
+                    digest = AvatarDigest(keep_bytes)
+                    async for chunk in resp.content.iter_chunked(AVATAR_CHUNK_SIZE):
+                        if digest.size + len(chunk) > AVATAR_MAX_BYTES:
+                            return None, f'too large (over {AVATAR_MAX_BYTES} bytes)'
+                        digest.update(chunk)
+                    return digest, None
+                reason = f'HTTP {resp.status}'
+                if resp.status not in RETRYABLE_STATUSES or last_attempt:
+                    return None, reason
+                delay = retry_delay(attempt, resp)
+        except asyncio.TimeoutError:
+            reason = 'timeout'
+            if last_attempt:
+                return None, reason
+            delay = retry_delay(attempt)
+        except aiohttp.ClientError as e:
+            # transient network error: retry with backoff
+            reason = f'network error ({type(e).__name__})'
+            if last_attempt:
+                return None, reason
+            delay = retry_delay(attempt)
+        except Exception as e:
+            return None, f'error ({e})'
+        await asyncio.sleep(delay)
+    return None, reason
+
+
+async def get_avatar_md5(avatar_url: str | None) -> tuple[str | None, str | None]:
+    """Fetch avatar asynchronously and compute MD5 hash. Returns (md5, None), or (None, failure reason)."""
+    digest, reason = await download_avatar(avatar_url)
+    return (digest.hexdigest(), None) if digest else (None, reason)
+
+
+class AvatarHashCache:
+    """LRU/TTL cache of avatar MD5s keyed by Discord asset key.
+
+    Avatar URLs are content-addressed by the asset hash, so a key never maps to a different image. Pinned
+    entries (the default avatars) are never evicted or expired.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (md5, stored_at)
+        self.pinned = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.entries) + len(self.pinned)
+
+    def get(self, key: str) -> str | None:
+        if key in self.pinned:
+            self.hits += 1
+            return self.pinned[key]
+        entry = self.entries.get(key)
+        if entry is None or time.time() - entry[1] > self.ttl:
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key: str, md5_value: str, stored_at: float | None = None):
+        self.entries[key] = (md5_value, time.time() if stored_at is None else stored_at)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def pin(self, key: str, md5_value: str):
+        self.pinned[key] = md5_value
+
+    def load(self, file_path: str):
+        """Restore unexpired entries saved by save(); a missing or corrupt file just means a cold cache."""
+        if not file_path or not os.path.exists(file_path):
+            return
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"[ICON] Ignoring unreadable avatar cache {file_path}: {e}")
+            return
+        now = time.time()
+        for key, (md5_value, stored_at) in sorted(saved.items(), key=lambda item: item[1][1]):
+            if now - stored_at <= self.ttl:
+                self.put(key, md5_value, stored_at)
+
+    def save(self, file_path: str):
+        if file_path:
+            write_text_atomic(file_path, json.dumps({key: list(entry) for key, entry in self.entries.items()}))
+
+
+avatar_hash_cache = AvatarHashCache(AVATAR_CACHE_SIZE, AVATAR_CACHE_TTL)
+avatar_fetches_in_flight: dict[str, asyncio.Future] = {}
+
+
+def avatar_asset(member: discord.abc.User) -> tuple[str | None, str | None]:
+    """(cache key, url) of the avatar the MD5 check uses: the user's own avatar, else their default one.
+
+    Custom avatars are requested at AVATAR_HASH_SIZE, as a static PNG unless animated (or always with
+    AVATAR_HASH_STATIC), so a given avatar always yields the same digest.
+    """
+    if member.avatar is not None:
+        asset = member.avatar
+        image_format = 'png' if AVATAR_HASH_STATIC or not asset.is_animated() else 'gif'
+        return f"{asset.key}.{image_format}@{AVATAR_HASH_SIZE}", asset.replace(format=image_format, size=AVATAR_HASH_SIZE).url
+    avatar = member.default_avatar or member.display_avatar
+    if avatar is None:
+        return None, None
+    return f"default/{avatar.key}", avatar.url
+
+
+async def get_member_avatar_md5(member: discord.abc.User) -> tuple[str | None, str | None]:
+    """(MD5, None) of member's avatar, or (None, failure reason). Served from the cache when the asset was
+    seen before; concurrent lookups of the same uncached asset (typical in raids) share one download."""
+    key, avatar_url = avatar_asset(member)
+    if key is None:
+        return None, 'no avatar'
+    cached = avatar_hash_cache.get(key)
+    if cached:
+        return cached, None
+    pending = avatar_fetches_in_flight.get(key)
+    if pending is not None:
+        return await asyncio.shield(pending)
+    future = asyncio.get_running_loop().create_future()
+    avatar_fetches_in_flight[key] = future
+    result = (None, 'cancelled')
+    try:
+        result = await get_avatar_md5(avatar_url)
+        if result[0]:
+            avatar_hash_cache.put(key, result[0])
+    finally:
+        del avatar_fetches_in_flight[key]
+        future.set_result(result)
+    return result
+
+
+seed_avatar_task = None  # Started by start_background_tasks
+
+
+async def seed_default_avatar_hashes():
+    """Pin the MD5s of Discord's fixed set of default avatars so members without one never hit the network."""
+    indexes = range(len(discord.DefaultAvatar))
+    urls = [f"{discord.Asset.BASE}/embed/avatars/{i}.png" for i in indexes]
+    try:
+        results = await asyncio.gather(*(get_avatar_md5(url) for url in urls))
+    except Exception as e:
+        print(f"[ICON] Failed to seed default avatar hashes: {e!r}")
+        return
+    for i, (avatar_md5, reason) in zip(indexes, results):
+        if avatar_md5:
+            avatar_hash_cache.pin(f"default/{i}", avatar_md5)
+    print(f"[ICON] Seeded {len(avatar_hash_cache.pinned)}/{len(urls)} default avatar hashes")
+
+
+BLOCKLIST_FILE = 'list.txt'
+
+
+def is_md5(value: str) -> bool:
+    """True if value is 32 lowercase hex characters."""
+    return len(value) == 32 and all(c in '0123456789abcdef' for c in value)
+
+
+def parse_md5_lines(text: str) -> tuple[set[str], int]:
+    """Split text (one MD5 per line) into the set of valid hashes and a count of invalid lines."""
+    valid = set()
+    invalid = 0
+    for line in text.splitlines():
+        value = line.strip().lower()
+        if not value:
+            continue
+        if is_md5(value):
+            valid.add(value)
+        else:
+            invalid += 1
+    return valid, invalid
+
+
+def file_stat(file_path: str) -> tuple[int, int] | None:
+    """(mtime_ns, size) of file_path, or None if it doesn't exist."""
+    try:
+        st = os.stat(file_path)
+    except FileNotFoundError:
         return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def append_lines(file_path: str, values: list[str]):
+    """Append one value per line to file_path (adding a missing final newline first) and fsync."""
+    needs_newline = False
+    if os.path.exists(file_path) and os.path.getsize(file_path):
+        with open(file_path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b'\n'
+    with open(file_path, 'a', encoding='utf-8') as f:
+        if needs_newline:
+            f.write('\n')
+        f.write(''.join(v + '\n' for v in values))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class Blocklist:
+    """Resident set of blocked avatar MD5s backed by list.txt (one per line).
+
+    Lookups never touch disk. The file is reread only when its mtime/size change (hand edits, picked up
+    by reload_blocklist_task); edits made through the bot append new lines or rewrite the file once per
+    batch via a temp file + rename, then record the new mtime so they don't trigger a reload.
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.hashes = set()
+        self._stat = None
+        self._lock = asyncio.Lock()
+
+    def __contains__(self, md5_value: str) -> bool:
+        return md5_value in self.hashes
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def _file_stat(self):
+        return file_stat(self.file_path)
+
+    def reload(self):
+        """Read the file into memory unconditionally."""
+        stat = self._file_stat()
+        if stat is None:
+            self.hashes = set()
+        else:
+            with open(self.file_path, 'r', encoding='utf-8') as f:
+                self.hashes = set(line.strip().lower() for line in f if line.strip())
+        self._stat = stat
+
+    def reload_if_changed(self) -> bool:
+        """Reread the file if it changed on disk since the last load or write. Returns True if reloaded."""
+        if self._file_stat() == self._stat:
+            return False
+        self.reload()
+        return True
+
+    def _append(self, values: list[str]):
+        append_lines(self.file_path, values)
+        self._stat = self._file_stat()
+
+    def _rewrite(self, hashes: set[str]):
+        write_text_atomic(self.file_path, ''.join(v + '\n' for v in sorted(hashes)))
+        self._stat = self._file_stat()
+
+    async def refresh(self) -> bool:
+        async with self._lock:
+            return await asyncio.to_thread(self.reload_if_changed)
+
+    async def add(self, values) -> list[str]:
+        """Append every value not already blocked; returns the newly added hashes."""
+        async with self._lock:
+            await asyncio.to_thread(self.reload_if_changed)
+            added = sorted(set(values) - self.hashes)
+            if added:
+                await asyncio.to_thread(self._append, added)
+                self.hashes.update(added)
+            return added
+
+    async def remove(self, values) -> list[str]:
+        """Drop every listed value with a single atomic rewrite; returns the hashes actually removed."""
+        async with self._lock:
+            await asyncio.to_thread(self.reload_if_changed)
+            removed = sorted(set(values) & self.hashes)
+            if removed:
+                remaining = self.hashes.difference(removed)
+                await asyncio.to_thread(self._rewrite, remaining)
+                self.hashes = remaining
+            return removed
+
+    def export(self) -> bytes:
+        """The list in list.txt format, for /md5 list."""
+        return export_icons_file(self.file_path)
+
+
+# Compiled blocklist file: header, optional Bloom filter bits, then count sorted 16-byte MD5 digests.
+# The header also records the (mtime_ns, size) of the list.txt the digests match, so an outside edit to
+# either file is told apart from the bot's own writes without comparing mtimes.
+BLOCKLIST_BIN_MAGIC = b'MD5B'
+BLOCKLIST_BIN_VERSION = 2
+BLOCKLIST_BIN_HEADER = struct.Struct('<4sHHQQQQ')  # magic, version, bloom hash count, digest count, bloom bytes, source mtime_ns, source size
+BLOCKLIST_BIN_SOURCE = struct.Struct('<QQ')  # the last two header fields, rewritten in place by stamp_compiled_source
+BLOCKLIST_BIN_SOURCE_OFFSET = BLOCKLIST_BIN_HEADER.size - BLOCKLIST_BIN_SOURCE.size
+BLOCKLIST_BLOOM_BITS_PER_ENTRY = 10
+BLOCKLIST_BLOOM_HASHES = 7  # ~1% false positives at 10 bits per entry
+BLOCKLIST_COMPILE_BATCH = 65536  # list.txt lines converted to digests at a time
+U64_MASK = (1 << 64) - 1
+
+
+def digests_from_hashes(hashes) -> np.ndarray:
+    """Sorted, de-duplicated array of 16-byte digests for an iterable of hex MD5 strings."""
+    data = b''.join(bytes.fromhex(h) for h in hashes)
+    return np.unique(np.frombuffer(data, dtype='S16'))
+
+
+def bloom_filter_bits(digests: np.ndarray, k: int) -> bytes:
+    """Bloom filter over digests, indexed by double hashing on the two halves of each digest."""
+    nbits = max(len(digests) * BLOCKLIST_BLOOM_BITS_PER_ENTRY, 64)
+    nbits -= nbits % 8
+    halves = np.frombuffer(digests.tobytes(), dtype='>u8').astype(np.uint64).reshape(-1, 2)
+    h1, h2 = halves[:, 0], halves[:, 1] | np.uint64(1)
+    bits = np.zeros(nbits, dtype=bool)
+    for i in range(k):
+        bits[(h1 + np.uint64(i) * h2) % np.uint64(nbits)] = True  # uint64 wraps like the & U64_MASK in lookups
+    return np.packbits(bits, bitorder='little').tobytes()
+
+
+def write_compiled_blocklist(file_path: str, digests: np.ndarray, source: tuple[int, int] | None, bloom: bool = True):
+    """Atomically write sorted digests (and a Bloom filter) to file_path, stamped with the source list.txt stat."""
+    k = BLOCKLIST_BLOOM_HASHES if bloom and len(digests) else 0
+    bloom_bytes = bloom_filter_bits(digests, k) if k else b''
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(BLOCKLIST_BIN_HEADER.pack(BLOCKLIST_BIN_MAGIC, BLOCKLIST_BIN_VERSION, k, len(digests), len(bloom_bytes),
+                                          *(source or (0, 0))))
+        f.write(bloom_bytes)
+        f.write(digests.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+
+
+def stamp_compiled_source(file_path: str, source: tuple[int, int]):
+    """Record a new list.txt stat in a compiled file's header without rewriting the digests."""
+    with open(file_path, 'r+b') as f:
+        f.seek(BLOCKLIST_BIN_SOURCE_OFFSET)
+        f.write(BLOCKLIST_BIN_SOURCE.pack(*source))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def compile_blocklist(text_path: str, bin_path: str, bloom: bool = True) -> int:
+    """Convert list.txt to the compiled format, streaming it in batches so only digests are held in memory.
+    Returns the number of digests written."""
+    source = file_stat(text_path)  # taken first: an edit made while compiling leaves a mismatch and is recompiled
+    parts, batch, invalid = [], [], 0
+    if source is not None:
+        with open(text_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                value = line.strip().lower()
+                if not value:
+                    continue
+                if not is_md5(value):
+                    invalid += 1
+                    continue
+                batch.append(value)
+                if len(batch) >= BLOCKLIST_COMPILE_BATCH:
+                    parts.append(digests_from_hashes(batch))
+                    batch = []
+        if invalid:
+            print(f"[ICON] skipped {invalid} invalid lines while compiling {text_path}")
+    parts.append(digests_from_hashes(batch))
+    digests = np.unique(np.concatenate(parts))
+    write_compiled_blocklist(bin_path, digests, source, bloom)
+    return len(digests)
+
+
+def decompile_blocklist(digests: np.ndarray, text_path: str, chunk: int = 65536):
+    """Atomically write digests back out as list.txt, a chunk at a time."""
+    tmp_path = f"{text_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for i in range(0, len(digests), chunk):
+            raw = digests[i:i + chunk].tobytes()
+            f.write(''.join(raw[j:j + 16].hex() + '\n' for j in range(0, len(raw), 16)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, text_path)
+
+
+def filter_blocklist_text(text_path: str, removed: set[str]):
+    """Atomically drop the lines holding any of removed from list.txt, streaming it line by line."""
+    tmp_path = f"{text_path}.tmp"
+    with open(text_path, 'r', encoding='utf-8') as src, open(tmp_path, 'w', encoding='utf-8') as dst:
+        for line in src:
+            if line.strip().lower() not in removed:
+                dst.write(line if line.endswith('\n') else line + '\n')
+        dst.flush()
+        os.fsync(dst.fileno())
+    os.replace(tmp_path, text_path)
+
+
+class CompiledBlocklistView:
+    """One mapping of a compiled blocklist file. Replaced as a whole when the file changes."""
+
+    __slots__ = ('mm', 'count', 'k', 'bloom_offset', 'bloom_bits', 'data_offset', 'source')
+
+    def __init__(self, file_path: str):
+        with open(file_path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(mm) < BLOCKLIST_BIN_HEADER.size or mm[:4] != BLOCKLIST_BIN_MAGIC:
+            mm.close()
+            raise ValueError(f"{file_path} is not a compiled blocklist")
+        magic, version, k, count, bloom_bytes, mtime_ns, size = BLOCKLIST_BIN_HEADER.unpack_from(mm, 0)
+        if version != BLOCKLIST_BIN_VERSION:
+            mm.close()
+            raise ValueError(f"{file_path} is a version {version} compiled blocklist (expected {BLOCKLIST_BIN_VERSION})")
+        self.mm = mm
+        self.count = count
+        self.k = k
+        self.bloom_offset = BLOCKLIST_BIN_HEADER.size
+        self.bloom_bits = bloom_bytes * 8
+        self.data_offset = self.bloom_offset + bloom_bytes
+        self.source = (mtime_ns, size)
+
+    def digests(self) -> np.ndarray:
+        return np.frombuffer(self.mm, dtype='S16', count=self.count, offset=self.data_offset)
+
+    def close(self):
+        try:
+            self.mm.close()
+        except BufferError:
+            pass  # a digests() array still points into the map; it is unmapped once that array is freed
+
+
+class CompiledBlocklist(Blocklist):
+    """Blocklist backed by a memory-mapped file of sorted 16-byte digests instead of a set of str.
+
+    Membership is a Bloom filter check followed by a binary search over the mapping, so startup cost and
+    resident memory don't grow with the list. list.txt is kept as a text mirror: a hand edit to it is
+    recompiled into the binary file, a replaced binary file is decompiled back to it, and /md5 list sends it.
+    All file work runs in a worker thread; the new mapping is swapped in (and the old one closed) on the loop.
+    """
+
+    def __init__(self, file_path: str, text_path: str, bloom: bool = True):
+        super().__init__(file_path)
+        self.text_path = text_path
+        self.bloom = bloom
+        self._text_stat = None
+        self._view = None
+
+    def __len__(self) -> int:
+        return self._view.count if self._view else 0
+
+    def __contains__(self, md5_value: str) -> bool:
+        view = self._view
+        if not view or not is_md5(md5_value):
+            return False
+        mm, count, data_offset = view.mm, view.count, view.data_offset
+        digest = bytes.fromhex(md5_value)
+        if view.k:
+            h1 = int.from_bytes(digest[:8], 'big')
+            h2 = int.from_bytes(digest[8:], 'big') | 1
+            for i in range(view.k):
+                bit = ((h1 + i * h2) & U64_MASK) % view.bloom_bits
+                if not mm[view.bloom_offset + (bit >> 3)] & (1 << (bit & 7)):
+                    return False
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = data_offset + mid * 16
+            if mm[start:start + 16] < digest:
+                lo = mid + 1
+            else:
+                hi = mid
+        start = data_offset + lo * 16
+        return lo < count and mm[start:start + 16] == digest
+
+    def _load(self, force: bool = False):
+        """(view, text stat, binary stat) for the files on disk, compiling or mirroring as needed, or None
+        if neither file changed since the last load. Runs in a worker thread."""
+        text_stat, bin_stat = file_stat(self.text_path), self._file_stat()
+        text_changed = force or text_stat != self._text_stat
+        bin_changed = force or bin_stat != self._stat
+        if not text_changed and not bin_changed:
+            return None
+        view = None
+        if bin_stat is not None:
+            try:
+                view = CompiledBlocklistView(self.file_path)
+            except ValueError as e:
+                print(f"[ICON] {e}, recompiling it from {self.text_path}")
+        if view is not None and view.source == text_stat:
+            return view, text_stat, bin_stat  # list.txt is exactly what the binary file was built from
+        # One side was edited outside the bot. When both changed (or at startup) the newer file wins.
+        text_wins = text_stat is not None and (view is None or not bin_changed or (text_changed and text_stat[0] > bin_stat[0]))
+        if text_wins:
+            if view is not None:
+                view.close()
+            count = compile_blocklist(self.text_path, self.file_path, self.bloom)
+            print(f"[ICON] compiled {count} icons from {self.text_path} into {self.file_path}")
+            view = CompiledBlocklistView(self.file_path)
+            return view, view.source, self._file_stat()
+        if view is None:
+            return None, text_stat, bin_stat  # no list.txt and no usable binary file
+        decompile_blocklist(view.digests(), self.text_path)
+        text_stat = file_stat(self.text_path)
+        stamp_compiled_source(self.file_path, text_stat)
+        return view, text_stat, self._file_stat()
+
+    def _install(self, loaded):
+        """Swap in a (view, text stat, binary stat) from _load/_edit. Called on the loop, between lookups."""
+        view, self._text_stat, self._stat = loaded
+        old, self._view = self._view, view
+        if old is not None and old is not view:
+            old.close()
+
+    def reload(self):
+        """Map the compiled file, compiling it from list.txt first if that is missing or was edited."""
+        self._install(self._load(force=True))
+
+    def reload_if_changed(self) -> bool:
+        loaded = self._load()
+        if loaded is None:
+            return False
+        self._install(loaded)
+        return True
+
+    async def refresh(self) -> bool:
+        """Recompile after an outside edit to list.txt, or remap (and mirror) a replaced binary file."""
+        async with self._lock:
+            loaded = await asyncio.to_thread(self._load)
+            if loaded is None:
+                return False
+            self._install(loaded)
+            return True
+
+    def digests(self) -> np.ndarray:
+        view = self._view
+        return view.digests() if view else np.empty(0, dtype='S16')
+
+    def _edit(self, view: CompiledBlocklistView | None, added: list[str], removed: list[str]):
+        """Apply an edit to both files: list.txt gets appended to (or filtered), the binary file is rebuilt by
+        merging into the sorted digests. Runs in a worker thread; returns what _install expects."""
+        current = view.digests() if view else np.empty(0, dtype='S16')
+        if added:
+            append_lines(self.text_path, added)
+            digests = np.union1d(current, digests_from_hashes(added))
+        else:
+            filter_blocklist_text(self.text_path, set(removed))
+            digests = np.setdiff1d(current, digests_from_hashes(removed), assume_unique=True)
+        text_stat = file_stat(self.text_path)
+        write_compiled_blocklist(self.file_path, digests, text_stat, self.bloom)
+        return CompiledBlocklistView(self.file_path), text_stat, self._file_stat()
+
+    async def _apply(self, added: list[str], removed: list[str]):
+        loaded = await asyncio.to_thread(self._edit, self._view, added, removed)
+        self._install(loaded)
+
+    async def add(self, values) -> list[str]:
+        async with self._lock:
+            if loaded := await asyncio.to_thread(self._load):
+                self._install(loaded)
+            added = sorted(v for v in set(values) if v not in self)
+            if added:
+                await self._apply(added, [])
+            return added
+
+    async def remove(self, values) -> list[str]:
+        async with self._lock:
+            if loaded := await asyncio.to_thread(self._load):
+                self._install(loaded)
+            removed = sorted(v for v in set(values) if v in self)
+            if removed:
+                await self._apply([], removed)
+            return removed
+
+    def export(self) -> bytes:
+        return export_icons_file(self.text_path)
+
+
+if BLOCKLIST_FORMAT == 'binary':
+    blocklist = CompiledBlocklist(BLOCKLIST_BIN_FILE, BLOCKLIST_FILE, BLOCKLIST_BLOOM)
+else:
+    blocklist = Blocklist(BLOCKLIST_FILE)
+
+
+@tasks.loop(seconds=BLOCKLIST_RELOAD_INTERVAL)
+async def reload_blocklist_task():
+    """Pick up hand edits to list.txt without a restart."""
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(avatar_url) as resp:
-                if resp.status != 200:
-                    return None
-                content = await resp.read()
-                return hashlib.md5(content).hexdigest()
+        if await blocklist.refresh():
+            print(f"[ICON] {blocklist.file_path} changed on disk, reloaded {len(blocklist)} icons")
+        if await phash_blocklist.refresh():
+            print(f"[ICON] {phash_blocklist.file_path} changed on disk, reloaded {len(phash_blocklist)} perceptual hashes")
+    except Exception as e:
+        print(f"[ICON] Error reloading {blocklist.file_path}: {e}")
+
+
+@tasks.loop(seconds=CONFIG_RELOAD_INTERVAL)
+async def reload_config_task():
+    """Pick up hand edits to .conf without a restart."""
+    try:
+        if await reload_config():
+            print(f"[CONFIG] {CONFIG_FILE} changed on disk, reloaded")
+    except Exception as e:
+        print(f"[CONFIG] Keeping the running config, {CONFIG_FILE} was rejected: {e}")
+
+
+# Perceptual hashing (optional, needs Pillow): catches re-encoded, resized or lightly cropped copies of a
+# blocked avatar, which get a different MD5. Hashes are 64-bit ints compared by Hamming distance.
+def dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)
+    matrix = np.sqrt(2 / n) * np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n))
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+DCT_32 = dct_matrix(32)
+
+
+def compute_perceptual_hash(data: bytes, algorithm: str = 'dhash') -> int | None:
+    """64-bit dHash (gradient) or pHash (DCT) of an image, or None if it can't be decoded. Runs in phash_executor."""
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img = img.convert('L')
+            if algorithm == 'phash':
+                pixels = np.asarray(img.resize((32, 32), Image.Resampling.LANCZOS), dtype=np.float64)
+                low = (DCT_32 @ pixels @ DCT_32.T)[:8, :8].flatten()
+                bits = low > np.median(low[1:])
+            else:
+                pixels = np.asarray(img.resize((9, 8), Image.Resampling.LANCZOS), dtype=np.int16)
+                bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
     except Exception:
-        # network error or similar
         return None
+    return int(np.packbits(bits).view('>u8')[0])
 
 
-def load_icons(file_path: str = 'list.txt') -> set[str]:
-    """Load MD5 strings from list.txt (one per line) into a set."""
-    if not os.path.exists(file_path):
-        return set()
-    with open(file_path, 'r', encoding='utf-8') as f:
-        return set(line.strip() for line in f if line.strip())
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
 
 
-def add_md5_to_file(md5_value: str, file_path: str = 'list.txt') -> bool:
-    """Add an MD5 signature to file_path. Returns True if added, False if it already existed."""
-    md5_value = md5_value.strip().lower()
-    if not md5_value:
-        return False
-    icons = load_icons(file_path)
-    if md5_value in icons:
-        return False
-    icons.add(md5_value)
-    with open(file_path, 'w', encoding='utf-8') as f:
-        for i in sorted(icons):
-            f.write(i + '\n')
-    return True
+class BKTree:
+    """Burkhard-Keller tree of 64-bit hashes under Hamming distance.
 
+    Children are keyed by their distance to the parent; by the triangle inequality a search only has to
+    descend into edges within max_distance of the query's own distance, so lookups stay sublinear.
+    """
 
-def remove_md5_from_file(md5_value: str, file_path: str = 'list.txt') -> bool:
-    """Remove an MD5 from file_path. Returns True if removed, False if not found."""
-    md5_value = md5_value.strip().lower()
-    if not md5_value:
-        return False
-    icons = load_icons(file_path)
-    if md5_value not in icons:
-        return False
-    icons.remove(md5_value)
-    with open(file_path, 'w', encoding='utf-8') as f:
-        for i in sorted(icons):
-            f.write(i + '\n')
-    return True
+    def __init__(self):
+        self.root = None  # (hash, {distance: child})
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def add(self, value: int):
+        if self.root is None:
+            self.root = (value, {})
+            self.size = 1
+            return
+        node = self.root
+        while True:
+            distance = hamming_distance(value, node[0])
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = (value, {})
+                self.size += 1
+                return
+            node = child
+
+    def search(self, value: int, max_distance: int) -> list[tuple[int, int]]:
+        """(distance, hash) of every entry within max_distance, closest first."""
+        results = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node_value, children = stack.pop()
+            distance = hamming_distance(value, node_value)
+            if distance <= max_distance:
+                results.append((distance, node_value))
+            for edge, child in children.items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        return sorted(results)
+
+
+class PerceptualBlocklist(Blocklist):
+    """Perceptual hashes of blocked avatars, one "<algorithm>:<16 hex digits>" per line, indexed in a BK-tree.
+
+    Lines hashed with a different algorithm than PHASH_ALGORITHM stay in the file but are not matched.
+    """
+
+    def __init__(self, file_path: str, algorithm: str):
+        super().__init__(file_path)
+        self.algorithm = algorithm
+        self.tree = BKTree()
+
+    def __len__(self) -> int:
+        return len(self.tree)
+
+    def entry(self, value: int) -> str:
+        return f"{self.algorithm}:{value:016x}"
+
+    def _build_tree(self):
+        tree = BKTree()
+        prefix = f"{self.algorithm}:"
+        for line in self.hashes:
+            if line.startswith(prefix):
+                try:
+                    tree.add(int(line[len(prefix):], 16))
+                except ValueError:
+                    pass
+        self.tree = tree
+
+    def reload(self):
+        super().reload()
+        self._build_tree()
+
+    async def add(self, values) -> list[str]:
+        added = await super().add(values)
+        for line in added:
+            self.tree.add(int(line.split(':', 1)[1], 16))
+        return added
+
+    async def remove(self, values) -> list[str]:
+        removed = await super().remove(values)
+        if removed:
+            self._build_tree()
+        return removed
+
+    def match(self, value: int, max_distance: int) -> tuple[int, int] | None:
+        """(distance, listed hash) of the closest entry within max_distance, or None."""
+        results = self.tree.search(value, max_distance)
+        return results[0] if results else None
+
+
+phash_blocklist = PerceptualBlocklist(PHASH_FILE, PHASH_ALGORITHM)
+phash_cache = AvatarHashCache(AVATAR_CACHE_SIZE, AVATAR_CACHE_TTL)
+phash_executor: concurrent.futures.Executor | None = None
+
+
+def get_phash_executor() -> concurrent.futures.Executor:
+    """Process pool for image decoding. Workers come from a forkserver (spawn where that is unavailable), never
+    a plain fork: forking a process that already runs threads (sqlite, to_thread workers) can deadlock on a lock
+    one of them held. The workers import bot.py without running it; the bot only starts, and loads its data,
+    under __main__."""
+    global phash_executor
+    if phash_executor is None:
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        phash_executor = concurrent.futures.ProcessPoolExecutor(PHASH_WORKERS, mp_context=multiprocessing.get_context(method))
+    return phash_executor
+
+
+phash_fetches_in_flight: dict[str, asyncio.Future] = {}
+
+
+async def get_member_avatar_phash(member: discord.abc.User) -> int | None:
+    """Perceptual hash of member's avatar (None with PHASH_CHECK off or without Pillow, so the worker pool is
+    never started then). The download also fills the MD5 cache; concurrent lookups of the same uncached
+    asset, e.g. a join check and a scan, share one download and hash."""
+    if not PHASH_CHECK or Image is None:
+        return None
+    key, avatar_url = avatar_asset(member)
+    if key is None:
+        return None
+    cached = phash_cache.get(key)
+    if cached:
+        return int(cached, 16)
+    pending = phash_fetches_in_flight.get(key)
+    if pending is not None:
+        return await asyncio.shield(pending)
+    future = asyncio.get_running_loop().create_future()
+    phash_fetches_in_flight[key] = future
+    value = None
+    try:
+        digest, _ = await download_avatar(avatar_url, keep_bytes=True)
+        if digest is not None:
+            avatar_hash_cache.put(key, digest.hexdigest())
+            value = await asyncio.get_running_loop().run_in_executor(get_phash_executor(), compute_perceptual_hash, bytes(digest.data), PHASH_ALGORITHM)
+            if value is not None:
+                phash_cache.put(key, f"{value:016x}")
+    finally:
+        del phash_fetches_in_flight[key]
+        future.set_result(value)
+    return value
 
 
 def export_icons_file(file_path: str = 'list.txt') -> bytes:
@@ -296,47 +2858,87 @@ def export_icons_file(file_path: str = 'list.txt') -> bytes:
 
 
 async def log_ban_action(user_id: int, user_name: str, action: str, moderator_id: int, moderator_name: str):
-    """Log ban actions to bot_ban_log.txt"""
+    """Log ban actions through the storage backend (bot_ban_log.txt or the moderation_actions table)"""
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    log_entry = f"[{timestamp}] User ID: {user_id} ({user_name}) | Action: {action} | Moderator ID: {moderator_id} ({moderator_name})\n"
-    
-    with open('bot_ban_log.txt', 'a', encoding='utf-8') as f:
-        f.write(log_entry)
+    await storage.log_moderation({
+        "timestamp": timestamp,
+        "user_id": user_id,
+        "user_name": user_name,
+        "action": action,
+        "moderator_id": moderator_id,
+        "moderator_name": moderator_name
+    })
 
 
 async def handle_user_banned(user_id: int, banned_by_name: str):
-    """Edit warning message if one exists for this user and they were banned within 10 seconds."""
-    if user_id not in recent_warnings:
+    """Edit warning message if one exists for this user and they were banned within 10 seconds. A warning
+    still queued for sending is edited by register_warning once it goes out."""
+    warning = warning_store.recent(user_id)
+    if warning is None:
+        if warning_store.note_ban(user_id, banned_by_name):
+            print(f"[ICON] Warning for banned user {user_id} is still queued; it is updated once sent")
         return
-    
-    warning_data = recent_warnings[user_id]
-    elapsed = (datetime.now(timezone.utc) - warning_data["timestamp"]).total_seconds()
-    
-    # Only edit if within 10 seconds
-    if elapsed <= 10:
-        message = warning_data["message"]
+    message_id, warning_data = warning
+
+    channel = bot.get_channel(warning_data['channel_id'])
+    if channel is not None:
         try:
             # Edit the message to remove buttons and add "removed by" info
-            new_content = message.content.replace("— has default icon", f"— has default icon — removed by {banned_by_name}")
-            await message.edit(
+            new_content = warning_data['content'].replace("— has default icon", f"— has default icon — removed by {banned_by_name}")
+            await channel.get_partial_message(message_id).edit(
                 content=new_content,
                 view=None
             )
             print(f"[ICON] Updated warning message for banned user {user_id}")
         except Exception as e:
             print(f"[ICON] Failed to edit warning message: {e}")
-    
+
     # Clean up
-    recent_warnings.pop(user_id, None)
+    await warning_store.resolve(message_id)
+
+
+@bot.event
+async def on_raw_message_delete(payload: discord.RawMessageDeleteEvent):
+    """A deleted warning message can't be acted on any more; forget it."""
+    if warning_store.get(payload.message_id):
+        await warning_store.resolve(payload.message_id)
+
+
+@bot.event
+async def on_raw_bulk_message_delete(payload: discord.RawBulkMessageDeleteEvent):
+    await warning_store.resolve(*(payload.message_ids & warning_store.warnings.keys()))
+
+
+async def register_warning(message: discord.Message, member_id: int):
+    """Store a warning once the notifier has sent it, applying a ban that landed while it was queued."""
+    entry = warning_store.pending.pop(member_id, None)
+    await warning_store.add(message, member_id)
+    if entry is not None and entry[1] is not None:
+        await handle_user_banned(member_id, entry[1])
+
+
+def warning_target_id(message: discord.Message) -> int | None:
+    """Member id a warning message is about: from the warning store, else from the ":warning: <id> — ..." text."""
+    warning_data = warning_store.get(message.id)
+    if warning_data:
+        return warning_data['member_id']
+    parts = message.content.split()
+    if len(parts) > 1 and parts[1].isdigit():
+        return int(parts[1])
+    return None
+
 
 # MD5 bot check button helper
 class MD5ResponseView(discord.ui.View):
-    """View with Positive (ban) and Negative (flag) buttons for MD5 matches."""
-    
-    def __init__(self, member: discord.Member, timeout: int | None = None):
-        super().__init__(timeout=timeout)  # timeout=None means buttons never expire
-        self.member = member
-    
+    """View with Positive (ban) and Negative (flag) buttons for MD5 matches.
+
+    The view holds no member: one persistent instance, registered at startup, handles the buttons of every
+    warning message (including ones posted before a restart) and looks the target up with warning_target_id.
+    """
+
+    def __init__(self):
+        super().__init__(timeout=None)  # buttons never expire
+
     @discord.ui.button(label="Positive - Ban", style=discord.ButtonStyle.red, emoji="⚠️", custom_id="md5_positive_ban")
     async def positive_button(self, interaction: discord.Interaction, button: discord.ui.Button):
         """Ban the user and log the action."""
@@ -344,20 +2946,27 @@ class MD5ResponseView(discord.ui.View):
             # Defer the interaction immediately to avoid timeout
             await interaction.response.defer()
             
-            # Ban the user
-            await self.member.ban(reason=f"MD5 icon match - banned by {interaction.user}")
+            member_id = warning_target_id(interaction.message)
+            if member_id is None:
+                await interaction.followup.send("❌ Could not tell which user this warning is about", ephemeral=True)
+                return
+            member = interaction.guild.get_member(member_id)
+
+            # Ban the user (works whether or not they are still in the server)
+            await interaction.guild.ban(discord.Object(id=member_id), reason=f"MD5 icon match - banned by {interaction.user}")
             
             # Log the action
             await log_ban_action(
-                user_id=self.member.id,
-                user_name=str(self.member),
+                user_id=member_id,
+                user_name=str(member) if member else str(member_id),
                 action="BANNED",
                 moderator_id=interaction.user.id,
                 moderator_name=str(interaction.user)
             )
             
             # Edit warning message if it exists
-            await handle_user_banned(self.member.id, str(interaction.user))
+            await handle_user_banned(member_id, str(interaction.user))
+            await warning_store.resolve(interaction.message.id)
             
             # Send confirmation message via followup
             # Add red-square reaction to the original warning message
@@ -365,7 +2974,7 @@ class MD5ResponseView(discord.ui.View):
 
             # Send ephemeral confirmation message via followup
             await interaction.followup.send(
-                f"✅ User ID {self.member.id} banned",
+                f"✅ User ID {member_id} banned",
                 ephemeral=True
             )
 
@@ -385,13 +2994,20 @@ class MD5ResponseView(discord.ui.View):
             # Defer the interaction immediately to avoid timeout
             await interaction.response.defer()
             
+            member_id = warning_target_id(interaction.message)
+            if member_id is None:
+                await interaction.followup.send("❌ Could not tell which user this warning is about", ephemeral=True)
+                return
+            member = interaction.guild.get_member(member_id)
+
             # Add green_square reaction
             await interaction.message.add_reaction("🟢")
+            await warning_store.resolve(interaction.message.id)
             
             # Log the action
             await log_ban_action(
-                user_id=self.member.id,
-                user_name=str(self.member),
+                user_id=member_id,
+                user_name=str(member) if member else str(member_id),
                 action="FLAGGED_NEGATIVE",
                 moderator_id=interaction.user.id,
                 moderator_name=str(interaction.user)
@@ -413,166 +3029,558 @@ class MD5ResponseView(discord.ui.View):
             )
 
 
+class BanAuditLog:
+    """Ring buffer of recent ban audit-log entries ({banned user id: moderator name}).
+
+    Filled live from audit-log events. A warning whose ban isn't in it yet triggers one audit-log fetch
+    per guild, started after a short delay so that a whole burst of bans shares the same request.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.entries = OrderedDict()
+        self.refreshes = {}  # guild id -> in-flight fetch task
+
+    def record(self, user_id: int, moderator_name: str):
+        self.entries[user_id] = moderator_name
+        self.entries.move_to_end(user_id)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    async def _fetch(self, guild: discord.Guild):
+        await asyncio.sleep(BAN_AUDIT_DEBOUNCE)
+        try:
+            entries = [entry async for entry in guild.audit_logs(limit=self.size, action=discord.AuditLogAction.ban)]
+        except Exception as e:
+            print(f"[ICON] Failed to check audit log for bans: {e}")
+            return
+        for entry in reversed(entries):  # oldest first, so the newest end up last in the ring
+            if entry.target is not None:
+                self.record(entry.target.id, audit_entry_user(entry))
+
+    async def moderator_for(self, guild: discord.Guild, user_id: int) -> str | None:
+        if user_id not in self.entries:
+            task = self.refreshes.get(guild.id)
+            if task is None or task.done():
+                task = self.refreshes[guild.id] = asyncio.create_task(self._fetch(guild))
+            await asyncio.shield(task)
+        return self.entries.get(user_id)
+
+
+def audit_entry_user(entry: discord.AuditLogEntry) -> str:
+    return str(entry.user) if entry.user is not None else str(entry.user_id)
+
+
+ban_audit_log = BanAuditLog(BAN_AUDIT_BUFFER)
+
+
 @bot.event
-async def on_member_remove(member: discord.Member):
-    """Check if member was banned and edit warning message if so."""
-    if member.id not in recent_warnings:
+async def on_audit_log_entry_create(entry: discord.AuditLogEntry):
+    """Record bans as they happen and update any open warning for the banned user."""
+    if entry.action != discord.AuditLogAction.ban or entry.target is None:
         return
-    
-    try:
-        # Check audit logs to see if this was a ban
-        async for entry in member.guild.audit_logs(limit=10, action=discord.AuditLogAction.ban):
-            if entry.target.id == member.id:
-                # Found the ban, edit the warning message
-                await handle_user_banned(member.id, str(entry.user))
-                print(f"[ICON] Detected ban for user {member.id} by {entry.user}")
-                return
-    except Exception as e:
-        print(f"[ICON] Failed to check audit log for ban: {e}")
+    moderator_name = audit_entry_user(entry)
+    ban_audit_log.record(entry.target.id, moderator_name)
+    if warning_store.awaiting_ban(entry.target.id):
+        await handle_user_banned(entry.target.id, moderator_name)
+        print(f"[ICON] Detected ban for user {entry.target.id} by {moderator_name}")
 
 
 @bot.event
-async def on_member_join(member: discord.Member):
-    """On new member join: compute avatar MD5 and post to LOG_CHANNEL_ID if it matches list.txt."""
-    try:
-        # Check if MD5 checking is enabled
-        if not MD5_CHECK_STATUS:
-            print(f"[ICON] MD5 checking is disabled (MD5_CHECK_STATUS=False)")
+async def on_member_ban(guild: discord.Guild, user: discord.User | discord.Member):
+    """Edit the warning message of a banned user, looking the moderator up in the shared audit-log buffer."""
+    if not warning_store.awaiting_ban(user.id):
+        return
+    moderator_name = await ban_audit_log.moderator_for(guild, user.id)
+    if moderator_name is None:
+        # on_audit_log_entry_create will still catch it if the entry shows up late
+        print(f"[ICON] No audit log entry yet for ban of user {user.id}")
+        return
+    await handle_user_banned(user.id, moderator_name)
+    print(f"[ICON] Detected ban for user {user.id} by {moderator_name}")
+
+
+def account_age_days(member: discord.abc.User) -> int | None:
+    created = getattr(member, 'created_at', None)
+    if not created:
+        return None
+    if created.tzinfo is None:
+        created = created.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - created).days
+
+
+class JoinPipeline:
+    """Bounded queue of joined members checked by a pool of workers, so a join raid can't stall the
+    gateway handler or fan out into hundreds of concurrent downloads.
+
+    Repeat joins of a member already queued are dropped, and joins past JOIN_QUEUE_MAX are shed.
+    Accounts young enough to trigger a notification are always dequeued first. While the backlog is at
+    least JOIN_RAID_THRESHOLD deep the pipeline is in raid mode, where older accounts (which can never be
+    reported) are skipped without hashing; it leaves raid mode once the queue drains.
+    """
+
+    def __init__(self, workers: int, max_depth: int, raid_threshold: int):
+        self.workers = workers
+        self.raid_threshold = raid_threshold
+        self.queue = asyncio.PriorityQueue(maxsize=max_depth)
+        self.queued_ids = set()
+        self.sequence = itertools.count()
+        self.tasks = []
+        self.raid_mode = False
+        self.shedding = False
+        self.stats = {'queued': 0, 'processed': 0, 'duplicates': 0, 'dropped': 0, 'raid_skipped': 0,
+                      'max_depth': 0, 'last_lag': 0.0, 'max_lag': 0.0}
+
+    def start(self):
+        if not self.tasks:
+            self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+            print(f"[ICON] Join check pipeline started with {self.workers} workers")
+
+    def submit(self, member: discord.Member):
+        if member.id in self.queued_ids:
+            self.stats['duplicates'] += 1
             return
-        
-        avatar = member.avatar or member.default_avatar or member.display_avatar
-        avatar_url = getattr(avatar, 'url', None)
+        age_days = account_age_days(member)
+        young = age_days is None or age_days < CONFIG.md5_acc_age_limit
+        item = (0 if young else 1, next(self.sequence), asyncio.get_running_loop().time(), member)
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            if not self.shedding:
+                print(f"[ICON] Join queue full ({self.queue.qsize()}), dropping join checks until it drains")
+            self.shedding = True
+            self.stats['dropped'] += 1
+            return
+        self.queued_ids.add(member.id)
+        self.stats['queued'] += 1
+        depth = self.queue.qsize()
+        self.stats['max_depth'] = max(self.stats['max_depth'], depth)
+        if not self.raid_mode and depth >= self.raid_threshold:
+            self.raid_mode = True
+            print(f"[ICON] Join queue at {depth}, entering raid mode (accounts older than {CONFIG.md5_acc_age_limit} days are skipped)")
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            priority, _, enqueued_at, member = await self.queue.get()
+            self.queued_ids.discard(member.id)
+            try:
+                lag = loop.time() - enqueued_at
+                self.stats['last_lag'] = lag
+                self.stats['max_lag'] = max(self.stats['max_lag'], lag)
+                if self.raid_mode and priority:
+                    self.stats['raid_skipped'] += 1
+                else:
+                    await check_member_avatar(member)
+                    self.stats['processed'] += 1
+            except Exception as e:
+                print(f"[ICON] Join check failed for member {member.id}: {e}")
+            finally:
+                self.queue.task_done()
+                if self.raid_mode and self.queue.empty():
+                    self.raid_mode = self.shedding = False
+                    print("[ICON] Join queue drained, leaving raid mode")
+
+    def status(self) -> str:
+        s = self.stats
+        return (f"Join queue: {self.queue.qsize()}/{self.queue.maxsize} waiting (peak {s['max_depth']}), "
+                f"{self.workers} workers, raid mode {'on' if self.raid_mode else 'off'}\n"
+                f"Queued {s['queued']}, checked {s['processed']}, skipped in raid mode {s['raid_skipped']}, "
+                f"duplicate joins {s['duplicates']}, dropped when full {s['dropped']}\n"
+                f"Lag: last {s['last_lag']:.1f}s, max {s['max_lag']:.1f}s")
+
+
+join_pipeline = JoinPipeline(JOIN_WORKERS, JOIN_QUEUE_MAX, JOIN_RAID_THRESHOLD)
+
+
+@bot.event
+async def on_member_join(member: discord.Member):
+    """On new member join: queue the avatar MD5 check (see check_member_avatar)."""
+    # Check if MD5 checking is enabled
+    if not CONFIG.md5_check_status:
+        print(f"[ICON] MD5 checking is disabled (MD5_CHECK_STATUS=False)")
+        return
+    join_pipeline.submit(member)
 
-        avatar_md5 = await get_avatar_md5(avatar_url)
+
+async def match_member_avatar(member: discord.Member) -> tuple[str | None, str | None, str | None]:
+    """(avatar MD5, match note, failure reason) for member. The note is None unless the avatar is listed:
+    '' for an MD5 match, or the distance for a perceptual one. The reason is set when hashing failed."""
+    # hash perceptually first: its download also fills the MD5 cache
+    perceptual = await get_member_avatar_phash(member)
+    avatar_md5, reason = await get_member_avatar_md5(member)
+    if not avatar_md5:
+        return None, None, reason
+    if avatar_md5 in blocklist:
+        return avatar_md5, '', None
+    match = phash_blocklist.match(perceptual, PHASH_MAX_DISTANCE) if perceptual is not None else None
+    if match is None:
+        return avatar_md5, None, None
+    distance, listed = match
+    print(f"[ICON] {PHASH_ALGORITHM} {perceptual:016x} within {distance} of listed {listed:016x}")
+    return avatar_md5, f" (perceptual match, distance {distance})", None
+
+
+async def check_member_avatar(member: discord.Member):
+    """Compute member's avatar MD5 and post to LOG_CHANNEL_ID if it matches list.txt."""
+    try:
+        avatar_url = avatar_asset(member)[1]
+        avatar_md5, match_note, reason = await match_member_avatar(member)
         print(f"[ICON] on_member_join: member={getattr(member,'id','?')} avatar_url={avatar_url} md5={avatar_md5}")
         if not avatar_md5:
+            print(f"[ICON] could not hash avatar of member {getattr(member,'id','?')}: {reason}")
             return
-
-        icons = load_icons('list.txt')
-        print(f"[ICON] loaded {len(icons)} icons from list.txt")
-        if avatar_md5 not in icons:
+        if match_note is None:
             print(f"[ICON] md5 {avatar_md5} not found in list.txt")
             return
 
-        print(f"[ICON] md5 {avatar_md5} matched list.txt — delivering to LOG_CHANNEL_ID {LOG_CHANNEL_ID}")
-        if LOG_CHANNEL_ID is None:
-            print("[ICON] LOG_CHANNEL_ID is None — no notification will be sent")
-            return
+        print(f"[ICON] md5 {avatar_md5} matched list.txt{match_note} — delivering to LOG_CHANNEL_ID {CONFIG.log_channel_id}")
+        await post_avatar_match(member, match_note)
+    except Exception as e:
+        print(f"[ICON] error checking member {getattr(member, 'id', 'unknown')}: {e}")
 
-        channel = bot.get_channel(LOG_CHANNEL_ID) or member.guild.get_channel(LOG_CHANNEL_ID)
-        if not channel:
-            try:
-                channel = await bot.fetch_channel(LOG_CHANNEL_ID)
-            except Exception as e:
-                print(f"[ICON] failed to fetch LOG_CHANNEL_ID {LOG_CHANNEL_ID}: {e}")
-                return
 
-        if not isinstance(channel, discord.TextChannel):
-            print(f"[ICON] LOG_CHANNEL_ID {LOG_CHANNEL_ID} resolved to non-text channel: {type(channel)}")
-            return
+async def post_avatar_match(member: discord.Member, match_note: str = '') -> bool:
+    """Queue a blocklisted-avatar warning with MD5ResponseView for LOG_CHANNEL_ID, subject to the account
+    age limit. Returns True if a warning was queued."""
+    if CONFIG.log_channel_id is None:
+        print("[ICON] LOG_CHANNEL_ID is None — no notification will be sent")
+        return False
 
-        try:
-            # Compute account age in a human-friendly form
-            created = getattr(member, 'created_at', None)
-            age_str = 'unknown'
-            age_days = None
-            if created:
-                # make sure both datetimes are timezone-aware for subtraction
-                now = datetime.now(timezone.utc)
-                if created.tzinfo is None:
-                    # treat created as UTC if naive
-                    created = created.replace(tzinfo=timezone.utc)
-                delta = now - created
-                days = delta.days
-                age_days = days
-                if days >= 365:
-                    years = days // 365
-                    months = (days % 365) // 30
-                    age_str = f"{years}y {months}m"
-                elif days >= 30:
-                    months = days // 30
-                    dd = days % 30
-                    age_str = f"{months}mo {dd}d"
-                elif days > 0:
-                    age_str = f"{days}d"
+    try:
+        # Compute account age in a human-friendly form
+        created = getattr(member, 'created_at', None)
+        age_str = 'unknown'
+        age_days = None
+        if created:
+            # make sure both datetimes are timezone-aware for subtraction
+            now = datetime.now(timezone.utc)
+            if created.tzinfo is None:
+                # treat created as UTC if naive
+                created = created.replace(tzinfo=timezone.utc)
+            delta = now - created
+            days = delta.days
+            age_days = days
+            if days >= 365:
+                years = days // 365
+                months = (days % 365) // 30
+                age_str = f"{years}y {months}m"
+            elif days >= 30:
+                months = days // 30
+                dd = days % 30
+                age_str = f"{months}mo {dd}d"
+            elif days > 0:
+                age_str = f"{days}d"
+            else:
+                hours = delta.seconds // 3600
+                if hours > 0:
+                    age_str = f"{hours}h"
                 else:
-                    hours = delta.seconds // 3600
-                    if hours > 0:
-                        age_str = f"{hours}h"
-                    else:
-                        mins = delta.seconds // 60
-                        age_str = f"{mins}m"
-            
-            # Check if account age exceeds notification limit
-            if age_days is not None and age_days >= MD5_ACC_AGE_NOTIFICATION_LIMIT:
-                print(f"[ICON] Account age ({age_days} days) exceeds notification limit ({MD5_ACC_AGE_NOTIFICATION_LIMIT} days) - skipping notification")
-                return
+                    mins = delta.seconds // 60
+                    age_str = f"{mins}m"
+        
+        # Check if account age exceeds notification limit
+        if age_days is not None and age_days >= CONFIG.md5_acc_age_limit:
+            print(f"[ICON] Account age ({age_days} days) exceeds notification limit ({CONFIG.md5_acc_age_limit} days) - skipping notification")
+            return False
 
-            # Create view with buttons
-            view = MD5ResponseView(member)
-            
-            # mention the user (preferred) rather than printing plain text
-            warning_message = await channel.send(f":warning: {member.id} — {member.mention} — account age: {age_str} — has default icon", view=view)
-            
-            # Store the message reference to update if user is banned
-            recent_warnings[member.id] = {
-                "message": warning_message,
-                "timestamp": datetime.now(timezone.utc),
-                "member": member  # Store member for view persistence on bot restart
-            }
-        except Exception as e:
-            print(f"[ICON] failed to send icon notice to LOG_CHANNEL_ID {LOG_CHANNEL_ID}: {e}")
+        # mention the user (preferred) rather than printing plain text; store the message once it is
+        # sent so a ban can update it (a ban before that is remembered against the queued warning)
+        warning_store.queue(member.id)
+        notifier.post(
+            CONFIG.log_channel_id,
+            f":warning: {member.id} — {member.mention} — account age: {age_str} — has default icon{match_note}",
+            priority=PRIORITY_MODERATION,
+            view=md5_response_buttons,
+            on_sent=lambda message: register_warning(message, member.id)
+        )
+        return True
     except Exception as e:
-        print(f"[ICON] error checking member {getattr(member, 'id', 'unknown')}: {e}")
+        print(f"[ICON] failed to send icon notice to LOG_CHANNEL_ID {CONFIG.log_channel_id}: {e}")
+        return False
+
+MD5_SCAN_CHECKPOINT_FILE = 'md5_scan_checkpoint.json'
+MD5_SCAN_CHUNK = 500  # Members hashed between checkpoints
+md5_scan_task = None
+
+
+def load_md5_scan_checkpoint() -> dict | None:
+    try:
+        with open(MD5_SCAN_CHECKPOINT_FILE, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+async def scan_member_avatar(member: discord.Member, semaphore: asyncio.Semaphore, checkpoint: dict):
+    async with semaphore:
+        avatar_md5, match_note, reason = await match_member_avatar(member)
+    if not avatar_md5:
+        checkpoint['failed'] += 1
+        print(f"[ICON] scan: could not hash avatar of member {member.id}: {reason}")
+        return
+    checkpoint['hashed'] += 1
+    if match_note is not None:
+        checkpoint['matched'] += 1
+        print(f"[ICON] scan: member {member.id} md5 {avatar_md5} matched list.txt{match_note}")
+        if warning_store.has_open(member.id):
+            # e.g. warned before a cancel or restart in the middle of the checkpointed chunk
+            print(f"[ICON] scan: member {member.id} already has an open warning, not posting another")
+        elif await post_avatar_match(member, match_note):
+            checkpoint['posted'] += 1
+
+
+async def run_md5_scan(guild: discord.Guild, checkpoint: dict):
+    """Check every existing member's avatar against the blocklist, in member id order.
+
+    Accounts over MD5_ACC_AGE_NOTIFICATION_LIMIT are skipped before hashing, the rest are hashed
+    MD5_SCAN_CONCURRENCY at a time, and progress is checkpointed after every chunk so an interrupted
+    scan resumes after the last finished one. Members re-checked after resuming who already have an
+    open warning are not warned twice.
+    """
+    if not guild.chunked:
+        await guild.chunk()
+    members = sorted((m for m in guild.members if m.id > checkpoint['last_member_id']), key=lambda m: m.id)
+    checkpoint['total'] = checkpoint['scanned'] + len(members)
+    semaphore = asyncio.Semaphore(MD5_SCAN_CONCURRENCY)
+    for start in range(0, len(members), MD5_SCAN_CHUNK):
+        chunk = members[start:start + MD5_SCAN_CHUNK]
+        to_hash = []
+        for member in chunk:
+            age_days = account_age_days(member)
+            if age_days is not None and age_days >= CONFIG.md5_acc_age_limit:
+                checkpoint['skipped_age'] += 1
+            else:
+                to_hash.append(member)
+        results = await asyncio.gather(*(scan_member_avatar(m, semaphore, checkpoint) for m in to_hash), return_exceptions=True)
+        for member, result in zip(to_hash, results):
+            if isinstance(result, asyncio.CancelledError):
+                raise result
+            if isinstance(result, Exception):
+                checkpoint['failed'] += 1
+                print(f"[ICON] scan: member {member.id} failed: {result}")
+        checkpoint['scanned'] += len(chunk)
+        checkpoint['last_member_id'] = chunk[-1].id
+        await asyncio.to_thread(write_text_atomic, MD5_SCAN_CHECKPOINT_FILE, json.dumps(checkpoint))
+        print(f"[ICON] scan: {checkpoint['scanned']}/{checkpoint['total']} members, {checkpoint['matched']} matches")
+    checkpoint['done'] = True
+    await asyncio.to_thread(write_text_atomic, MD5_SCAN_CHECKPOINT_FILE, json.dumps(checkpoint))
+    print(f"[ICON] scan finished: {format_md5_scan_status(checkpoint)}")
+
+
+def format_md5_scan_status(checkpoint: dict | None) -> str:
+    if not checkpoint:
+        return "No member scan has been run."
+    running = md5_scan_task is not None and not md5_scan_task.done()
+    state = 'running' if running else 'finished' if checkpoint['done'] else 'stopped'
+    return (f"Member scan {state}: {checkpoint['scanned']}/{checkpoint['total']} members — "
+            f"{checkpoint['hashed']} hashed, {checkpoint['skipped_age']} skipped (older than {CONFIG.md5_acc_age_limit} days), "
+            f"{checkpoint['failed']} failed, {checkpoint['matched']} matched, {checkpoint['posted']} warnings posted")
+
 
 # Slash commands
+PERIOD_DESCRIPTION = 'Time range: all, 7d, 30d, month, last_month, YYYY-MM-DD or YYYY-MM-DD..YYYY-MM-DD (default: all)'
+
+
+def bucketed_period(time_range: tuple[date, date, str] | None) -> tuple[date, date, str] | None:
+    """time_range as the time buckets count it. Ranges reaching into rolled-up months are widened to whole
+    months, and the label then shows the dates actually counted."""
+    if not time_range:
+        return time_range
+    start, end, label = time_range
+    covered = ping_buckets.covered(start, end, bucket_cutoff())
+    if covered == (start, end):
+        return time_range
+    return covered[0], covered[1], f"{label}, counted {covered[0].isoformat()} to {covered[1].isoformat()}"
+
+
+def stats_for_period(time_range: tuple[date, date, str] | None) -> PingStats:
+    """Lifetime store, or a columnar store summed from the time buckets for the given range."""
+    if not time_range:
+        return ping_data
+    return PingStats.from_bucket_totals(CONFIG.role_thresholds, ping_buckets.totals(time_range[0], time_range[1]))
+
+
+def format_summary(stats: PingStats) -> str:
+    """One line per category with totals and the distribution over active users."""
+    lines = []
+    for category, summary in stats.summary().items():
+        if summary['users']:
+            lines.append(f"{category}: {summary['total']} pings by {summary['users']} users "
+                         f"(median {summary['p50']:g}, p90 {summary['p90']:g}, max {summary['max']})")
+    return "\n".join(lines) + "\n\n" if lines else ""
+
+
+def report_user_name(user_id: str) -> str:
+    user = bot.get_user(int(user_id))
+    return user.name if user else f"Unknown User ({user_id})"
+
+
+class ReportPaginator(discord.ui.View):
+    """Ping report as embed pages with Prev/Next buttons. Pages are rendered on demand."""
+
+    def __init__(self, title: str, stats: PingStats, header: str = "", timeout: int | None = 600):
+        super().__init__(timeout=timeout)
+        self.title = title
+        self.stats = stats
+        self.header = header
+        self.user_ids = list(stats.user_ids)  # freeze the order; counts are read when a page renders
+        self.page = 0
+        self.message = None
+        self._sync_buttons()
+
+    @property
+    def page_count(self) -> int:
+        return max(1, -(-len(self.user_ids) // REPORT_PAGE_SIZE))
+
+    def render(self, page: int | None = None) -> discord.Embed:
+        page = self.page if page is None else page
+        lines = [self.header] if page == 0 and self.header else []
+        for user_id in self.user_ids[page * REPORT_PAGE_SIZE:(page + 1) * REPORT_PAGE_SIZE]:
+            data = self.stats.get(user_id)
+            categories = ", ".join(f"{category}: {count}" for category, count in data['categories'].items() if count)
+            lines.append(f"**{report_user_name(user_id)}** — {data['total_pings']} pings\n{categories}")
+        description = "\n".join(lines) or "No pings recorded."
+        embed = discord.Embed(title=self.title, description=description[:4096], color=discord.Color.blue())
+        embed.set_footer(text=f"Page {page + 1}/{self.page_count} — {len(self.user_ids)} users")
+        return embed
+
+    def _sync_buttons(self):
+        self.prev_page.disabled = self.page == 0
+        self.next_page.disabled = self.page >= self.page_count - 1
+
+    async def _show(self, interaction: discord.Interaction, page: int):
+        self.page = max(0, min(page, self.page_count - 1))
+        self._sync_buttons()
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+    @discord.ui.button(label="Prev", style=discord.ButtonStyle.secondary, emoji="◀️")
+    async def prev_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, self.page - 1)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary, emoji="▶️")
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, self.page + 1)
+
+    async def on_timeout(self):
+        if self.message:
+            try:
+                await self.message.edit(view=None)
+            except Exception as e:
+                print(f"[REPORT] Failed to remove report buttons: {e}")
+
+
+async def build_report_file(title: str, stats: PingStats) -> discord.File:
+    """Write the full report into a text file, yielding to the event loop between chunks."""
+    buffer = io.StringIO()
+    buffer.write(f"{title}\n\n")
+    for i, (user_id, data) in enumerate(stats.items(), start=1):
+        buffer.write(f"{report_user_name(user_id)}:\n")
+        buffer.write(f"Total pings: {data['total_pings']}\n")
+        for category, count in data['categories'].items():
+            buffer.write(f"{category}: {count}\n")
+        buffer.write("\n")
+        if i % 1000 == 0:
+            await asyncio.sleep(0)
+    return discord.File(fp=io.BytesIO(buffer.getvalue().encode('utf-8')), filename="ping_report.txt")
+
+
+def add_rank_field(embed: discord.Embed, stats: PingStats, user_id: str):
+    """Add the user's overall rank among tracked users to a stats embed."""
+    position = stats.rank(user_id)
+    if position:
+        embed.add_field(name="Rank", value=f"#{position[0]} of {len(stats)} (ahead of {position[1]:.0f}%)")
+
 
 
 
 @bot.tree.command(name="makereport", description="Generate the ping report now")
-async def makereport(interaction: discord.Interaction):
+@discord.app_commands.describe(period=PERIOD_DESCRIPTION)
+async def makereport(interaction: discord.Interaction, period: str | None = None):
     await log_command(interaction, "makereport")
-    if not any(role.id in ADMINISTRATOR_ROLES for role in interaction.user.roles):
+    if not is_admin(interaction.user):
         return await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
 
-    channel = bot.get_channel(PING_LOG_CHANNEL_ID)
+    try:
+        time_range = bucketed_period(parse_period(period))
+    except ValueError as e:
+        return await interaction.response.send_message(str(e), ephemeral=True)
+
+    # Acknowledge first: summing the period's buckets grows with the data and must not eat the 3 s deadline
+    await interaction.response.defer()
+
     # Build report (same logic as monthly_report)
-    report = "Ping Report\n\n"
-    for user_id, data in ping_data.items():
-        user = bot.get_user(int(user_id))
-        if user:
-            report += f"{user.name}:\n"
-            report += f"Total pings: {data['total_pings']}\n"
-            for category, count in data['categories'].items():
-                report += f"{category}: {count}\n"
-            report += "\n"
-    # Respond to the interaction with the report (visible to the channel or just the user)
-    await interaction.response.send_message(report, ephemeral=False)
+    report_data = stats_for_period(time_range)
+    title = f"Ping Report ({time_range[2]})" if time_range else "Ping Report"
+    report = ReportPaginator(title, report_data, format_summary(report_data))
+
+    # Only the first page is rendered up front; the rest render when someone pages to them
+    if report.page_count > 1:
+        report.message = await interaction.followup.send(embed=report.render(), view=report, wait=True)
+    else:
+        await interaction.followup.send(embed=report.render())
+    if len(report_data) > REPORT_FILE_THRESHOLD:
+        await interaction.followup.send("Full report attached:", file=await build_report_file(title, report_data))
 
 @bot.tree.command(name="checkstats", description="Generate ping stats for specified user")
-async def checkstats(interaction: discord.Interaction, member: discord.Member):
+@discord.app_commands.describe(period=PERIOD_DESCRIPTION)
+async def checkstats(interaction: discord.Interaction, member: discord.Member, period: str | None = None):
     await log_command(interaction, "checkstats")
-    if not any(role.id in ADMINISTRATOR_ROLES for role in interaction.user.roles):
+    if not is_admin(interaction.user):
         return await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
 
-    if str(member.id) in ping_data:
-        data = ping_data[str(member.id)]
-        embed = discord.Embed(title=f"Stats for {member.name}", color=discord.Color.blue())
+    try:
+        time_range = bucketed_period(parse_period(period))
+    except ValueError as e:
+        return await interaction.response.send_message(str(e), ephemeral=True)
+
+    # Ranking within a period sums every user's buckets for it, so acknowledge the interaction first
+    await interaction.response.defer()
+    data = await get_user_stats(str(member.id), time_range)
+    if data:
+        title = f"Stats for {member.name} ({time_range[2]})" if time_range else f"Stats for {member.name}"
+        embed = discord.Embed(title=title, color=discord.Color.blue())
         embed.add_field(name="Total Pings", value=str(data['total_pings']))
+        add_rank_field(embed, stats_for_period(time_range), str(member.id))
         for category, count in data['categories'].items():
             embed.add_field(name=category.title(), value=str(count))
-        await interaction.response.send_message(embed=embed)
+        await interaction.followup.send(embed=embed)
     else:
-        await interaction.response.send_message("No data found for this user.")
+        await interaction.followup.send("No data found for this user.")
+
+@bot.tree.command(name="leaderboard", description="Show the top pingers overall or for one category")
+@discord.app_commands.choices(category=[discord.app_commands.Choice(name=category, value=category) for category in CONFIG.role_thresholds])
+@discord.app_commands.describe(category='Category to rank by (default: total pings)', limit='Number of users to show (1-25, default: 10)')
+async def leaderboard(interaction: discord.Interaction, category: str | None = None, limit: int = 10):
+    await log_command(interaction, "leaderboard")
+    if not is_admin(interaction.user):
+        return await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
+
+    board = leaderboards.get(category)
+    if board is None:
+        return await interaction.response.send_message(f"Unknown category: {category}", ephemeral=True)
+
+    top = board.top(max(1, min(limit, 25)))
+    if not top:
+        return await interaction.response.send_message("No pings recorded yet.", ephemeral=True)
+
+    lines = []
+    for position, (user_id, score) in enumerate(top, start=1):
+        user = bot.get_user(int(user_id))
+        name = user.name if user else f"Unknown User ({user_id})"
+        lines.append(f"**{position}.** {name} — {score}")
+    title = f"Leaderboard — {category}" if category else "Leaderboard — Total Pings"
+    embed = discord.Embed(title=title, description="\n".join(lines), color=discord.Color.gold())
+    await interaction.response.send_message(embed=embed)
 
 @bot.tree.command(name="mystats", description="View your own ping statistics")
 async def mystats(interaction: discord.Interaction):
     await log_command(interaction, "mystats")
-    user_id = str(interaction.user.id)
-    if user_id in ping_data:
-        data = ping_data[user_id]
+    data = await get_user_stats(str(interaction.user.id))
+    if data:
         embed = discord.Embed(title=f"Your Stats", color=discord.Color.blue())
         embed.add_field(name="Total Pings", value=str(data['total_pings']))
+        add_rank_field(embed, ping_data, str(interaction.user.id))
         for category, count in data['categories'].items():
             embed.add_field(name=category.title(), value=str(count))
         await interaction.response.send_message(embed=embed, ephemeral=True)
@@ -596,20 +3604,26 @@ async def uptime(interaction: discord.Interaction):
 
 
 @bot.tree.command(name="viewlogs", description="View the command usage logs")
-async def viewlogs(interaction: discord.Interaction):
+@discord.app_commands.describe(user='Only show commands used by this user', command='Only show this command (name without the slash)', period=PERIOD_DESCRIPTION)
+async def viewlogs(interaction: discord.Interaction, user: discord.User | None = None, command: str | None = None, period: str | None = None):
     await log_command(interaction, "viewlogs")
-    if not any(role.id in ADMINISTRATOR_ROLES for role in interaction.user.roles):
+    if not is_admin(interaction.user):
         return await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
     
     try:
-        with open('commands_log.json', 'r') as f:
-            log_data = json.load(f)
-    except FileNotFoundError:
-        return await interaction.response.send_message("No command logs found.", ephemeral=True)
+        time_range = parse_period(period)
+    except ValueError as e:
+        return await interaction.response.send_message(str(e), ephemeral=True)
+    start = f"{time_range[0].isoformat()} 00:00:00" if time_range else None
+    end = f"{(time_range[1] + timedelta(days=1)).isoformat()} 00:00:00" if time_range else None
     
-    # Create a formatted message with the last 10 commands
-    log_entries = log_data[-10:]  # Get last 10 entries
-    response = "📋 **Last 10 Command Logs**\n\n"
+    # Create a formatted message with the last 10 matching commands
+    log_entries = await storage.recent_commands(
+        10, str(user.id) if user else None, command.strip().lstrip('/').lower() if command else None, start, end
+    )
+    if not log_entries:
+        return await interaction.response.send_message("No command logs found.", ephemeral=True)
+    response = f"📋 **Last {len(log_entries)} Command Logs**\n\n"
     
     for entry in log_entries:
         response += f"**Command:** /{entry['command']}\n"
@@ -632,18 +3646,19 @@ async def viewlogs(interaction: discord.Interaction):
     discord.app_commands.Choice(name='list', value='list'),
     discord.app_commands.Choice(name='status', value='status'),
     discord.app_commands.Choice(name='acc_age', value='acc_age'),
+    discord.app_commands.Choice(name='queue', value='queue'),
+    discord.app_commands.Choice(name='scan', value='scan'),
 ])
-@discord.app_commands.describe(action='Action to perform (check/add/remove/list/status/acc_age)', member='Member to inspect for check', value='MD5 value to add/remove, "on"/"off" for status, or number of days for acc_age')
-async def md5(interaction: discord.Interaction, action: str, member: discord.Member | None = None, value: str | None = None):
+@discord.app_commands.describe(action='Action to perform (check/add/remove/list/status/acc_age/queue/scan)', member='Member to inspect for check, or whose avatar to add', value='MD5 value to add/remove, "on"/"off" for status, number of days for acc_age, or start/status/cancel for scan', file='Text file of MD5s (one per line) to add/remove in bulk')
+async def md5(interaction: discord.Interaction, action: str, member: discord.Member | None = None, value: str | None = None, file: discord.Attachment | None = None):
     await log_command(interaction, "md5")
-    if not any(role.id in ADMINISTRATOR_ROLES for role in interaction.user.roles):
+    if not is_admin(interaction.user):
         return await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
     
     await interaction.response.defer()
     
     # Declare global variables at the start of the function
-    global MD5_CHECK_STATUS
-    global MD5_ACC_AGE_NOTIFICATION_LIMIT
+    global md5_scan_task
     
     # Action-based handling
     action = action.lower() if action else 'check'
@@ -653,62 +3668,126 @@ async def md5(interaction: discord.Interaction, action: str, member: discord.Mem
         if not member:
             await interaction.followup.send('You must supply a member when using action `check`', ephemeral=True)
             return
-        avatar = member.avatar or member.default_avatar or member.display_avatar
-        avatar_url = getattr(avatar, 'url', None)
-        avatar_md5 = await get_avatar_md5(avatar_url)
+        perceptual = await get_member_avatar_phash(member)
+        avatar_md5, reason = await get_member_avatar_md5(member)
         if not avatar_md5:
-            await interaction.followup.send(f'Could not fetch avatar for user {member.id}')
+            await interaction.followup.send(f'Could not fetch avatar for user {member.id}: {reason}')
             return
-        await interaction.followup.send(f'{member.id} avatar MD5: {avatar_md5}')
+        lines = [f'{member.id} avatar MD5: {avatar_md5}' + (' (listed)' if avatar_md5 in blocklist else '')]
+        if perceptual is not None:
+            nearest = phash_blocklist.match(perceptual, 64)
+            nearest_text = f'closest listed hash at distance {nearest[0]}' if nearest else 'no perceptual hashes listed'
+            lines.append(f'{PHASH_ALGORITHM}: {perceptual:016x} ({nearest_text}, match threshold {PHASH_MAX_DISTANCE})')
+        await interaction.followup.send('\n'.join(lines))
         return
 
-    # --- ADD: add a new MD5 value to list.txt
-    if action == 'add':
-        if not value:
-            await interaction.followup.send('You must provide an MD5 value to add (use the `value` parameter)', ephemeral=True)
-            return
-        normalized = value.strip().lower()
-        if len(normalized) != 32 or not all(c in '0123456789abcdef' for c in normalized):
-            await interaction.followup.send('Provided value does not look like a valid MD5 (32 hex chars).', ephemeral=True)
+    # --- ADD with a member: register their current avatar by MD5 and, with Pillow, by perceptual hash
+    if action == 'add' and member and not value and not file:
+        perceptual = await get_member_avatar_phash(member)
+        avatar_md5, reason = await get_member_avatar_md5(member)
+        if not avatar_md5:
+            await interaction.followup.send(f'Could not fetch avatar for user {member.id}: {reason}')
             return
-        added = add_md5_to_file(normalized, 'list.txt')
-        if added:
-            await interaction.followup.send(f'Added MD5 to list: {normalized}')
+        added = await blocklist.add([avatar_md5])
+        lines = [f'MD5 {avatar_md5}: {"added" if added else "already present"}']
+        if perceptual is not None:
+            added = await phash_blocklist.add([phash_blocklist.entry(perceptual)])
+            lines.append(f'{PHASH_ALGORITHM} {perceptual:016x}: {"added" if added else "already present"}')
         else:
-            await interaction.followup.send(f'MD5 already present: {normalized}')
+            lines.append('Perceptual hash not registered (PHASH_CHECK is off, Pillow is not installed or the avatar could not be decoded)')
+        await interaction.followup.send(f'Avatar of {member.id}:\n' + '\n'.join(lines))
         return
 
-    # --- REMOVE: remove an MD5 value from list.txt
-    if action == 'remove':
-        if not value:
-            await interaction.followup.send('You must provide an MD5 value to remove (use the `value` parameter)', ephemeral=True)
+    # --- ADD / REMOVE: edit list.txt from `value` and/or an uploaded file (one MD5 per line)
+    if action in ('add', 'remove'):
+        if not value and not file:
+            await interaction.followup.send(f'You must provide an MD5 value to {action} (use the `value` parameter) or upload a file of MD5s (use the `file` parameter)', ephemeral=True)
             return
-        normalized = value.strip().lower()
-        removed = remove_md5_from_file(normalized, 'list.txt')
-        if removed:
-            await interaction.followup.send(f'Removed MD5 from list: {normalized}')
+        hashes, invalid = parse_md5_lines(value or '')
+        if file:
+            try:
+                text = (await file.read()).decode('utf-8', errors='replace')
+            except discord.HTTPException as e:
+                await interaction.followup.send(f'Could not read uploaded file: {e}', ephemeral=True)
+                return
+            file_hashes, file_invalid = parse_md5_lines(text)
+            hashes |= file_hashes
+            invalid += file_invalid
+        if not hashes:
+            await interaction.followup.send('Provided value does not look like a valid MD5 (32 hex chars).', ephemeral=True)
+            return
+
+        if action == 'add':
+            changed = await blocklist.add(hashes)
+            done, skipped = 'Added', 'already present'
         else:
-            await interaction.followup.send(f'MD5 not found in list: {normalized}')
+            changed = await blocklist.remove(hashes)
+            done, skipped = 'Removed', 'not found in list'
+        if len(hashes) == 1 and not invalid:
+            normalized = next(iter(hashes))
+            if changed:
+                await interaction.followup.send(f'{done} MD5 {"to" if action == "add" else "from"} list: {normalized}')
+            else:
+                await interaction.followup.send(f'MD5 {skipped}: {normalized}')
+            return
+        summary = f'{done} {len(changed)} MD5s ({len(hashes) - len(changed)} {skipped}'
+        if invalid:
+            summary += f', {invalid} invalid lines skipped'
+        await interaction.followup.send(summary + f'). The list now holds {len(blocklist)} entries.')
         return
 
     # --- LIST: export list.txt as a file
     if action == 'list':
-        data = export_icons_file('list.txt')
+        data = await asyncio.to_thread(blocklist.export)
         if not data:
             await interaction.followup.send('icons list is empty or file not found')
             return
         import io
         buf = io.BytesIO(data)
         buf.seek(0)
-        file = discord.File(fp=buf, filename='list.txt')
-        await interaction.followup.send('Here is the current icons list:', file=file)
+        list_file = discord.File(fp=buf, filename='list.txt')
+        await interaction.followup.send('Here is the current icons list:', file=list_file)
+        return
+
+    # --- SCAN: check existing members against the blocklist in the background
+    if action == 'scan':
+        scan_action = (value or 'start').strip().lower()
+        running = md5_scan_task is not None and not md5_scan_task.done()
+        checkpoint = load_md5_scan_checkpoint()
+        if scan_action == 'status':
+            await interaction.followup.send(format_md5_scan_status(checkpoint))
+        elif scan_action == 'cancel':
+            if not running:
+                await interaction.followup.send('No member scan is running.')
+                return
+            md5_scan_task.cancel()
+            await interaction.followup.send('Member scan cancelled. Run `/md5 scan start` to resume from the checkpoint.')
+        elif scan_action == 'start':
+            if running:
+                await interaction.followup.send('A member scan is already running.')
+                return
+            if checkpoint and not checkpoint['done'] and checkpoint['guild_id'] == interaction.guild.id:
+                message = f"Resuming the member scan after {checkpoint['scanned']} members."
+            else:
+                checkpoint = {'guild_id': interaction.guild.id, 'last_member_id': 0, 'total': 0, 'scanned': 0, 'hashed': 0,
+                              'skipped_age': 0, 'failed': 0, 'matched': 0, 'posted': 0, 'done': False}
+                message = f"Member scan started for {interaction.guild.member_count} members."
+            md5_scan_task = asyncio.create_task(run_md5_scan(interaction.guild, checkpoint))
+            await interaction.followup.send(f"{message} Use `/md5 scan status` to follow progress.")
+        else:
+            await interaction.followup.send('Unknown scan action. Valid values: start, status, cancel', ephemeral=True)
+        return
+
+    # --- QUEUE: join check pipeline metrics
+    if action == 'queue':
+        await interaction.followup.send(join_pipeline.status())
         return
 
     # --- STATUS: toggle MD5_CHECK_STATUS on/off
     if action == 'status':
         if not value:
             # Show current status
-            status_text = "enabled" if MD5_CHECK_STATUS else "disabled"
+            status_text = "enabled" if CONFIG.md5_check_status else "disabled"
             await interaction.followup.send(f'MD5 checking is currently {status_text}. Use value "on" or "off" to change it.')
             return
         
@@ -721,13 +3800,12 @@ async def md5(interaction: discord.Interaction, action: str, member: discord.Mem
             await interaction.followup.send('Invalid value. Use "on" or "off".', ephemeral=True)
             return
         
-        # Update the global variable
-        MD5_CHECK_STATUS = new_status
-        
-        # Update the config file
-        CONFIG['MD5_CHECK_STATUS'] = new_status
-        with open('.conf', 'w') as f:
-            json.dump(CONFIG, f, indent=4)
+        # Update the config file and swap in the new config
+        try:
+            await save_config(MD5_CHECK_STATUS=new_status)
+        except (OSError, ValueError) as e:
+            await interaction.followup.send(f'Failed to save the config: {e}', ephemeral=True)
+            return
         
         status_text = "enabled" if new_status else "disabled"
         await interaction.followup.send(f'✅ MD5 checking {status_text}')
@@ -737,7 +3815,7 @@ async def md5(interaction: discord.Interaction, action: str, member: discord.Mem
     if action == 'acc_age':
         if not value:
             # Show current limit
-            await interaction.followup.send(f'Current account age notification limit: {MD5_ACC_AGE_NOTIFICATION_LIMIT} days. Provide a number to change it.')
+            await interaction.followup.send(f'Current account age notification limit: {CONFIG.md5_acc_age_limit} days. Provide a number to change it.')
             return
         
         try:
@@ -749,37 +3827,284 @@ async def md5(interaction: discord.Interaction, action: str, member: discord.Mem
             await interaction.followup.send('Invalid number. Please provide a valid number of days.', ephemeral=True)
             return
         
-        # Update the global variable
-        MD5_ACC_AGE_NOTIFICATION_LIMIT = new_limit
-        
-        # Update the config file
-        CONFIG['MD5_ACC_AGE_NOTIFICATION_LIMIT'] = new_limit
-        with open('.conf', 'w') as f:
-            json.dump(CONFIG, f, indent=4)
+        # Update the config file and swap in the new config
+        try:
+            await save_config(MD5_ACC_AGE_NOTIFICATION_LIMIT=new_limit)
+        except (OSError, ValueError) as e:
+            await interaction.followup.send(f'Failed to save the config: {e}', ephemeral=True)
+            return
         
         await interaction.followup.send(f'✅ Account age notification limit set to {new_limit} days')
         return
 
-    await interaction.followup.send('Unknown action. Valid actions: check, add, remove, list, status, acc_age', ephemeral=True)
+    await interaction.followup.send('Unknown action. Valid actions: check, add, remove, list, scan, queue, status, acc_age', ephemeral=True)
+
+@bot.tree.command(name="backfill", description="Recount pings from LFG channel history")
+@discord.app_commands.choices(action=[
+    discord.app_commands.Choice(name='start', value='start'),
+    discord.app_commands.Choice(name='status', value='status'),
+    discord.app_commands.Choice(name='cancel', value='cancel'),
+])
+@discord.app_commands.describe(action='Action to perform (start/status/cancel)', after='Only count messages after this date (YYYY-MM-DD) when starting a new backfill', categories='Comma-separated categories to recount when starting a new backfill (default: all)')
+async def backfill(interaction: discord.Interaction, action: str, after: str | None = None, categories: str | None = None):
+    """Start, resume, inspect or cancel the history backfill."""
+    global backfill_task
+    await log_command(interaction, "backfill")
+    if not is_admin(interaction.user):
+        return await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
+
+    action = action.lower() if action else 'status'
+    running = backfill_task is not None and not backfill_task.done()
+
+    if action == 'status':
+        return await interaction.response.send_message(format_backfill_status(load_backfill_checkpoint()), ephemeral=True)
+
+    if action == 'cancel':
+        if not running:
+            return await interaction.response.send_message("No backfill is running.", ephemeral=True)
+        backfill_task.cancel()
+        return await interaction.response.send_message("Backfill cancelled. Run `/backfill start` to resume from the checkpoint.", ephemeral=True)
+
+    if action == 'start':
+        if running:
+            return await interaction.response.send_message("A backfill is already running.", ephemeral=True)
+
+        checkpoint = load_backfill_checkpoint()
+        if checkpoint and not all(checkpoint['channels'].get(str(c), {}).get('done') for c in CONFIG.lfg_channel_ids):
+            message = "Resuming the previous backfill from its checkpoint."
+        else:
+            try:
+                after_time = datetime.combine(date.fromisoformat(after), datetime.min.time(), timezone.utc) if after else None
+            except ValueError:
+                return await interaction.response.send_message("Invalid date. Use YYYY-MM-DD.", ephemeral=True)
+            known = {category.lower(): category for category in CONFIG.role_thresholds}
+            selected = [part.strip() for part in (categories or '').split(',') if part.strip()]
+            unknown = [name for name in selected if name.lower() not in known]
+            if unknown:
+                return await interaction.response.send_message(
+                    f"Unknown categories: {', '.join(unknown)}. Valid categories: {', '.join(CONFIG.role_thresholds)}", ephemeral=True)
+            selected = list(dict.fromkeys(known[name.lower()] for name in selected)) or list(CONFIG.role_thresholds)
+            if after_time:
+                # An explicit start date applies to every selected category
+                floors = {category: int(after_time.timestamp()) for category in selected}
+            else:
+                floors = backfill_floors(selected)
+            oldest = None if any(floor is None for floor in floors.values()) else min(floors.values())
+            after_id = discord.utils.time_snowflake(datetime.fromtimestamp(oldest, timezone.utc)) if oldest else None
+            # Everything newer than `before` is counted live by on_message
+            checkpoint = {'before': discord.utils.time_snowflake(datetime.now(timezone.utc)), 'after': after_id, 'floors': floors, 'channels': {}}
+            message = f"Backfill started for {len(CONFIG.lfg_channel_ids)} channels, counting {format_backfill_floors(floors)}."
+
+        backfill_task = asyncio.create_task(run_backfill(checkpoint))
+        return await interaction.response.send_message(f"{message} Use `/backfill status` to follow progress.", ephemeral=True)
+
+    await interaction.response.send_message('Unknown action. Valid actions: start, status, cancel', ephemeral=True)
+
+@bot.tree.command(name="reloadconfig", description="Reload .conf without restarting the bot")
+async def reloadconfig(interaction: discord.Interaction):
+    await log_command(interaction, "reloadconfig")
+    if not is_admin(interaction.user):
+        return await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
+
+    try:
+        await reload_config(force=True)
+    except (OSError, ValueError) as e:
+        return await interaction.response.send_message(f"Config not reloaded, the running config is unchanged: {e}", ephemeral=True)
+    print(f"[CONFIG] {CONFIG_FILE} reloaded by {interaction.user}")
+    await interaction.response.send_message(f"✅ Reloaded {CONFIG_FILE}", ephemeral=True)
+
+@bot.tree.command(name="synccommands", description="Sync slash commands with Discord now")
+async def synccommands(interaction: discord.Interaction):
+    await log_command(interaction, "synccommands")
+    if not is_admin(interaction.user):
+        return await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
+
+    await interaction.response.defer(ephemeral=True)
+    try:
+        count = await sync_command_tree(force=True)
+    except Exception as e:
+        return await interaction.followup.send(f"Failed to sync commands: {e}", ephemeral=True)
+    await interaction.followup.send(f"✅ Synced {count} slash commands. Discord may take a moment to show the changes.", ephemeral=True)
 
 @bot.tree.command(name="shutdown", description="Shuts down the bot")
 async def shutdown(interaction: discord.Interaction):
     await log_command(interaction, "shutdown")
-    if not any(role.id in ADMINISTRATOR_ROLES for role in interaction.user.roles):
+    if not is_admin(interaction.user):
         return await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
 
     await interaction.response.send_message("kk bye :(")
-    await bot.close()
+    await graceful_shutdown()
     print(f'Script closed by {interaction.user}')
     
 
+def purgeable_roles(member: discord.Member) -> tuple[list[discord.Role], list[discord.Role]]:
+    """(kept, removed) roles for a purge: everything goes except ROLES_EXCEPTIONS and roles the bot can't
+    remove anyway (managed roles, roles above its own)."""
+    kept, removed = [], []
+    for role in member.roles:
+        if role.is_default():
+            continue
+        if role.id in CONFIG.role_exceptions or not role.is_assignable():
+            kept.append(role)
+        else:
+            removed.append(role)
+    return kept, removed
+
+
+async def purge_member_roles(member: discord.Member, reason: str) -> list[discord.Role]:
+    """Remove every purgeable role from member in a single request; returns the removed roles."""
+    kept, removed = purgeable_roles(member)
+    if removed:
+        await member.edit(roles=kept, reason=reason)
+    return removed
+
+
+# Mass rolepurge: one background job at a time, one member edit at a time
+rolepurge_task = None
+rolepurge_progress = None
+
+
+def check_inactive_days(inactive_days: int):
+    """Raise ValueError unless the ping buckets cover the whole inactive_days window. Pings from before
+    the buckets started (e.g. counted by a pre-journal version) are invisible to it, so everyone would look inactive."""
+    if inactive_days < 1:
+        raise ValueError("`inactive_days` must be at least 1.")
+    since = ping_buckets.since_day()
+    covered = (datetime.now(timezone.utc).date() - since).days + 1
+    if inactive_days > covered:
+        raise ValueError(f"Ping history only goes back to {since.isoformat()}, so inactivity can be judged over "
+                         f"at most {covered} day(s). Use a smaller `inactive_days`.")
+
+
+def is_purge_exempt(member: discord.Member) -> bool:
+    """Bots and administrators are never mass purged."""
+    return member.bot or is_admin(member)
+
+
+def select_rolepurge_targets(guild: discord.Guild, role: discord.Role | None, inactive_days: int | None, user_ids: str | None) -> tuple[list, str] | None:
+    """(members or member ids, description) for a mass purge by the one selection given, or None if there is
+    none. Bots and administrators are left out; listed ids that aren't cached are checked again when purged."""
+    if role is not None:
+        return [m for m in role.members if not is_purge_exempt(m)], f"members with {role.name}"
+    if inactive_days is not None:
+        active = stats_for_period(parse_period(f"{inactive_days}d"))
+        members = [m for m in guild.members if not is_purge_exempt(m) and str(m.id) not in active]
+        return members, f"members without pings in the last {inactive_days} days"
+    if user_ids:
+        ids = [int(part) for part in user_ids.replace(',', ' ').split() if part.isdigit()]
+        ids = [i for i in ids if (member := guild.get_member(i)) is None or not is_purge_exempt(member)]
+        return ids, f"{len(ids)} listed users"
+    return None
+
+
+async def run_mass_rolepurge(guild: discord.Guild, targets: list, reason: str):
+    """Purge targets one member edit at a time. discord.py waits out the guild's member-edit rate limit
+    bucket; ROLEPURGE_INTERVAL leaves headroom in it for the bot's other requests."""
+    progress = rolepurge_progress
+    for target in targets:
+        member = target
+        try:
+            if isinstance(target, int):
+                member = guild.get_member(target) or await guild.fetch_member(target)
+            # Checked again at purge time: a member may have been promoted since the selection
+            removed = [] if is_purge_exempt(member) else await purge_member_roles(member, reason)
+        except discord.NotFound:
+            progress['skipped'] += 1
+        except discord.HTTPException as e:
+            progress['failed'] += 1
+            print(f"[PURGE] Failed to purge roles of {getattr(member, 'id', member)}: {e}")
+        else:
+            if removed:
+                progress['purged'] += 1
+                progress['roles_removed'] += len(removed)
+                await asyncio.sleep(ROLEPURGE_INTERVAL)
+            else:
+                progress['skipped'] += 1
+        progress['done'] += 1
+        if progress['done'] % 100 == 0:
+            print(f"[PURGE] {rolepurge_counts(progress)}")
+    print(f"[PURGE] Mass rolepurge of {progress['selection']} finished: {rolepurge_counts(progress)}")
+
+
+def start_mass_rolepurge(guild: discord.Guild, targets: list, description: str, reason: str) -> bool:
+    """Start the background purge unless one is already running."""
+    global rolepurge_task, rolepurge_progress
+    if rolepurge_task is not None and not rolepurge_task.done():
+        return False
+    rolepurge_progress = {'selection': description, 'total': len(targets), 'done': 0, 'purged': 0, 'roles_removed': 0, 'skipped': 0, 'failed': 0}
+    rolepurge_task = asyncio.create_task(run_mass_rolepurge(guild, targets, reason))
+    print(f"[PURGE] Mass rolepurge of {len(targets)} {description} started ({reason})")
+    return True
+
+
+class RolepurgeConfirmView(discord.ui.View):
+    """Purge/Cancel buttons under a mass rolepurge's target count. Only the requesting admin can press them."""
+
+    def __init__(self, requester: discord.abc.User, guild: discord.Guild, targets: list, description: str, timeout: int = 120):
+        super().__init__(timeout=timeout)
+        self.requester = requester
+        self.guild = guild
+        self.targets = targets
+        self.description = description
+        self.message = None
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.requester.id:
+            await interaction.response.send_message("Only the admin who requested this purge can confirm it.", ephemeral=True)
+            return False
+        return True
+
+    @discord.ui.button(label="Purge", style=discord.ButtonStyle.danger)
+    async def confirm(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.stop()
+        if start_mass_rolepurge(self.guild, self.targets, self.description, f"Mass rolepurge executed by {self.requester}"):
+            content = (f"Mass rolepurge started for {len(self.targets)} {self.description}. "
+                       "Use `/rolepurge status` to follow progress or `/rolepurge cancel` to stop it.")
+        else:
+            content = "A mass rolepurge is already running; nothing was started."
+        await interaction.response.edit_message(content=content, view=None)
+
+    @discord.ui.button(label="Cancel", style=discord.ButtonStyle.secondary)
+    async def cancel(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.stop()
+        await interaction.response.edit_message(content="Mass rolepurge cancelled, no roles were removed.", view=None)
+
+    async def on_timeout(self):
+        if self.message:
+            try:
+                await self.message.edit(content="Mass rolepurge not confirmed in time, no roles were removed.", view=None)
+            except Exception as e:
+                print(f"[PURGE] Failed to expire the rolepurge confirmation: {e}")
+
+
+def rolepurge_counts(p: dict) -> str:
+    return (f"{p['done']}/{p['total']} members processed — {p['purged']} purged ({p['roles_removed']} roles removed), "
+            f"{p['skipped']} unchanged or gone, {p['failed']} failed")
+
+
+def format_rolepurge_status() -> str:
+    if not rolepurge_progress:
+        return "No mass rolepurge has been run."
+    running = rolepurge_task is not None and not rolepurge_task.done()
+    state = 'running' if running else 'cancelled' if rolepurge_task.cancelled() else 'finished'
+    return f"Mass rolepurge of {rolepurge_progress['selection']} {state}: {rolepurge_counts(rolepurge_progress)}"
+
+
 @bot.tree.command(name="rolepurge", description="Remove all roles except exceptions")
 @discord.app_commands.choices(action=[
     discord.app_commands.Choice(name='user', value='user'),
     discord.app_commands.Choice(name='myroles', value='myroles'),
+    discord.app_commands.Choice(name='mass', value='mass'),
+    discord.app_commands.Choice(name='status', value='status'),
+    discord.app_commands.Choice(name='cancel', value='cancel'),
 ])
-@discord.app_commands.describe(action='Action to perform (user/myroles)', user_id='User ID to purge roles from (required for user action)')
-async def rolepurge(interaction: discord.Interaction, action: str, user_id: str | None = None):
+@discord.app_commands.describe(
+    action='Action to perform (user/myroles, or mass/status/cancel for a background purge of many members)',
+    user_id='User ID to purge roles from (user action), or several IDs separated by spaces/commas (mass action)',
+    role='Mass action: purge every member with this role',
+    inactive_days='Mass action: purge every member with no tracked pings in this many days'
+)
+async def rolepurge(interaction: discord.Interaction, action: str, user_id: str | None = None, role: discord.Role | None = None, inactive_days: int | None = None):
     """Remove all roles from a user or requester, except those in ROLES_EXCEPTIONS."""
     await log_command(interaction, "rolepurge")
     
@@ -787,7 +4112,7 @@ async def rolepurge(interaction: discord.Interaction, action: str, user_id: str
     
     # --- USER ACTION: requires admin role
     if action == 'user':
-        if not any(role.id in ADMINISTRATOR_ROLES for role in interaction.user.roles):
+        if not is_admin(interaction.user):
             return await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
         
         if not user_id:
@@ -807,16 +4132,13 @@ async def rolepurge(interaction: discord.Interaction, action: str, user_id: str
         
         await interaction.response.defer()
         
-        # Remove all roles except those in ROLES_EXCEPTIONS
-        roles_to_remove = [role for role in member.roles if role.id not in ROLES_EXCEPTIONS and role != interaction.guild.default_role]
-        
-        if not roles_to_remove:
+        # Remove all roles except those in ROLES_EXCEPTIONS, in one request
+        if not purgeable_roles(member)[1]:
             await interaction.followup.send(f'User {member.mention} has no removable roles.', ephemeral=True)
             return
         
         try:
-            for role in roles_to_remove:
-                await member.remove_roles(role, reason=f"Rolepurge executed by {interaction.user}")
+            roles_to_remove = await purge_member_roles(member, f"Rolepurge executed by {interaction.user}")
             
             removed_names = ', '.join([role.name for role in roles_to_remove])
             await interaction.followup.send(
@@ -834,16 +4156,13 @@ async def rolepurge(interaction: discord.Interaction, action: str, user_id: str
         
         await interaction.response.defer()
         
-        # Remove all roles except those in ROLES_EXCEPTIONS
-        roles_to_remove = [role for role in member.roles if role.id not in ROLES_EXCEPTIONS and role != interaction.guild.default_role]
-        
-        if not roles_to_remove:
+        # Remove all roles except those in ROLES_EXCEPTIONS, in one request
+        if not purgeable_roles(member)[1]:
             await interaction.followup.send('You have no removable roles.', ephemeral=True)
             return
         
         try:
-            for role in roles_to_remove:
-                await member.remove_roles(role, reason="User executed rolepurge myroles")
+            roles_to_remove = await purge_member_roles(member, "User executed rolepurge myroles")
             
             removed_names = ', '.join([role.name for role in roles_to_remove])
             await interaction.followup.send(
@@ -855,64 +4174,170 @@ async def rolepurge(interaction: discord.Interaction, action: str, user_id: str
         
         return
     
-    await interaction.response.send_message('Unknown action. Valid actions: user, myroles', ephemeral=True)
+    # --- MASS / STATUS / CANCEL: background purge of many members, admin only
+    if action in ('mass', 'status', 'cancel'):
+        if not is_admin(interaction.user):
+            return await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
+        running = rolepurge_task is not None and not rolepurge_task.done()
+
+        if action == 'status':
+            return await interaction.response.send_message(format_rolepurge_status(), ephemeral=True)
+
+        if action == 'cancel':
+            if not running:
+                return await interaction.response.send_message("No mass rolepurge is running.", ephemeral=True)
+            rolepurge_task.cancel()
+            return await interaction.response.send_message(f"Mass rolepurge cancelled after {rolepurge_progress['done']} members.", ephemeral=True)
+
+        if running:
+            return await interaction.response.send_message("A mass rolepurge is already running.", ephemeral=True)
+        if sum(option is not None for option in (role, inactive_days, user_id or None)) > 1:
+            return await interaction.response.send_message("Choose only one of `role`, `inactive_days` or `user_id`.", ephemeral=True)
+        if inactive_days is not None:
+            try:
+                check_inactive_days(inactive_days)
+            except ValueError as e:
+                return await interaction.response.send_message(str(e), ephemeral=True)
+        await interaction.response.defer()
+        if not interaction.guild.chunked:
+            await interaction.guild.chunk()
+        selection = select_rolepurge_targets(interaction.guild, role, inactive_days, user_id)
+        if selection is None:
+            await interaction.followup.send('Choose who to purge with `role`, `inactive_days` or `user_id` (a list of IDs).', ephemeral=True)
+            return
+        targets, description = selection
+        if not targets:
+            await interaction.followup.send(f'No {description} to purge.', ephemeral=True)
+            return
+
+        # Dry run: nothing is removed until the requester confirms the target count
+        view = RolepurgeConfirmView(interaction.user, interaction.guild, targets, description)
+        view.message = await interaction.followup.send(
+            f'This will remove the roles of **{len(targets)}** {description} (exception roles are kept). Purge them?',
+            view=view, wait=True)
+        return
+
+    await interaction.response.send_message('Unknown action. Valid actions: user, myroles, mass, status, cancel', ephemeral=True)
+
+
+def iter_export_rows(stats: PingStats):
+    """Yield [user id, nickname, total, *category counts] rows, converting the columns chunk by chunk."""
+    for start in range(0, len(stats), EXPORT_CHUNK_ROWS):
+        end = start + EXPORT_CHUNK_ROWS
+        # Read-only cache lookups; the export runs in a worker thread
+        for user_id, total, counts in zip(stats.user_ids[start:end], stats.totals[start:end].tolist(), stats.counts[start:end].tolist()):
+            user = bot.get_user(int(user_id))
+            yield [user_id, user.name if user else "Unknown User", total, *counts]
 
 
-@bot.tree.command(name="export", description="Export the current stats as an Excel file")
-async def export_stats(interaction: discord.Interaction):
+def write_export_file(stats: PingStats, file_format: str) -> str:
+    """Stream stats into EXPORT_DIR as csv/jsonl/xlsx and return the file path (gzipped when large)."""
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    header = ['User ID', 'Nickname', 'Total Pings', *stats.categories]
+    path = os.path.join(EXPORT_DIR, f"ping_stats_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{file_format}")
+
+    try:
+        if file_format == 'xlsx':
+            import openpyxl
+            workbook = openpyxl.Workbook(write_only=True)
+            sheet = workbook.create_sheet('Ping Stats')
+            sheet.append(header)
+            for row in iter_export_rows(stats):
+                sheet.append(row)
+            workbook.save(path)
+            return path  # already zip-compressed
+
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            if file_format == 'csv':
+                writer = csv.writer(f)
+                writer.writerow(header)
+                writer.writerows(iter_export_rows(stats))
+            else:
+                f.writelines(json.dumps(dict(zip(header, row))) + '\n' for row in iter_export_rows(stats))
+    except BaseException:
+        # Don't leave a half-written export behind
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+
+    if os.path.getsize(path) > EXPORT_COMPRESS_THRESHOLD:
+        with open(path, 'rb') as fin, gzip.open(f"{path}.gz", 'wb') as fout:
+            shutil.copyfileobj(fin, fout)
+        os.remove(path)
+        path = f"{path}.gz"
+    return path
+
+
+@bot.tree.command(name="export", description="Export the current stats as a CSV, JSONL or Excel file")
+@discord.app_commands.choices(file_format=[
+    discord.app_commands.Choice(name='xlsx', value='xlsx'),
+    discord.app_commands.Choice(name='csv', value='csv'),
+    discord.app_commands.Choice(name='jsonl', value='jsonl'),
+])
+@discord.app_commands.describe(file_format='Output format (default: xlsx)', period=PERIOD_DESCRIPTION)
+async def export_stats(interaction: discord.Interaction, file_format: str = 'xlsx', period: str | None = None):
     await log_command(interaction, "export")
-    if not any(role.id in ADMINISTRATOR_ROLES for role in interaction.user.roles):
+    if not is_admin(interaction.user):
         return await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
 
     try:
+        time_range = parse_period(period)
+    except ValueError as e:
+        return await interaction.response.send_message(str(e), ephemeral=True)
+
+    await interaction.response.defer(ephemeral=True)
+    try:
+        # Copy the columns on the loop (cheap), then stream the rows to disk from a worker thread
+        stats = stats_for_period(time_range).copy()
+        path = await asyncio.to_thread(write_export_file, stats, file_format)
         
-        # Create a list to store the data for each user
-        data_rows = []
-        
-        # Iterate through each user's data
-        for user_id, data in ping_data.items():
-            user = bot.get_user(int(user_id))
-            nickname = user.name if user else "Unknown User"
-            
-            # Create a row with user info and all category counts
-            row = {
-                'User ID': user_id,
-                'Nickname': nickname,
-                'Total Pings': data['total_pings']
-            }
-            # Add all category counts
-            row.update(data['categories'])
-            
-            data_rows.append(row)
-        
-        # Create DataFrame
-        df = pd.DataFrame(data_rows)
-        
-        # Save to BytesIO buffer
-        excel_buffer = io.BytesIO()
-        df.to_excel(excel_buffer, index=False)
-        excel_buffer.seek(0)
-        
-        # Create Discord file
-        file = discord.File(
-            fp=excel_buffer,
-            filename="ping_stats.xlsx"
-        )
+        size = os.path.getsize(path)
+        upload_limit = interaction.guild.filesize_limit if interaction.guild else 10 * 1024 * 1024
+        if size > upload_limit:
+            await interaction.followup.send(
+                f"The export is {size / (1024 * 1024):.1f} MB, which is over this server's upload limit. "
+                f"It was saved on the bot host as `{path}`.",
+                ephemeral=True
+            )
+            return
         
-        await interaction.response.send_message(
-            "Here are the current stats in Excel format:",
-            file=file,
-            ephemeral=True
-        )
+        try:
+            await interaction.followup.send(
+                f"Here are the current stats in {file_format.upper()} format:",
+                file=discord.File(fp=path, filename=os.path.basename(path)),
+                ephemeral=True
+            )
+        finally:
+            # Only exports too big to upload are kept on the host
+            os.remove(path)
         
     except Exception as e:
-        await interaction.response.send_message(
-            f"An error occurred while generating the Excel file: {str(e)}",
+        await interaction.followup.send(
+            f"An error occurred while generating the export: {str(e)}",
             ephemeral=True
         )
 
 
-with open(".env", "r") as f:
-    token = f.read().strip()
+def load_state():
+    """Load ping data, open warnings, the avatar cache and the blocklists. Only done when bot.py runs as the
+    main script, so perceptual-hash worker processes importing it stay cheap."""
+    global ping_data, ping_buckets, leaderboards
+    ping_data, ping_buckets = storage.load_ping_data()
+    leaderboards = build_leaderboards(ping_data)
+    warning_store.load()
+    avatar_hash_cache.load(AVATAR_CACHE_FILE)
+    blocklist.reload()
+    print(f"[ICON] loaded {len(blocklist)} icons from {blocklist.file_path}")
+    phash_blocklist.reload()
+
+
+if __name__ == "__main__":
+    load_state()
+
+    with open(".env", "r") as f:
+        token = f.read().strip()
+
+    bot.run(token)
 
-bot.run(token)
\ No newline at end of file
+    # Last-chance flush in case the loop stopped with events still pending
+    storage.close(pending_pings)
\ No newline at end of file